@@ -0,0 +1,652 @@
+"""
+    本地模拟CDN的下载性能测试
+
+    启动本地HTTP服务模拟 get_token / getplayinfo / m3u8 / get_dk 接口和加密的ts视频，
+    对不同的分块大小、连接数、下载模式分别在子进程中完整跑一遍 解析地址 => 下载 => 解密，
+    统计吞吐量、p50/p99 完成时间、峰值内存和写入字节数
+
+    Usage:
+        python benchmark.py --size 64 --threads 4,20 --chunk-sizes 1,4 --modes range,hls
+        python benchmark.py --latency 50 --bandwidth 2048 --fault 0.05 --repeat 5 --output bench.json
+        python benchmark.py --import-budget 150
+        python benchmark.py --remux --size 8 --segment-size 0.5 --threads 4 --chunk-sizes 1
+
+    --remux 时视频为生成的H.264/AAC TS（编码数据为随机字节，不能播放），
+    两种模式下载时都转为MP4，检查输出的每条track的帧数与帧数据是否与生成的一致
+"""
+import os
+import re
+import sys
+import json
+import time
+import struct
+import binascii
+import random
+import socket
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import httpx
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad
+
+
+KEY = bytes(range(16))
+MB = 1024 * 1024
+
+# 生成的TS：PID、帧率、GOP长度、音频采样率（ADTS sampling_frequency_index 4）
+VIDEO_PID, AUDIO_PID, PMT_PID = 0x100, 0x101, 0x1000
+FPS, GOP = 25, 50
+SAMPLE_RATE = 44100
+
+
+class BitWriter(object):
+
+    def __init__(self):
+        self.bits = []
+
+    def write(self, value: int, count: int):
+        self.bits += [value >> index & 1 for index in reversed(range(count))]
+
+    def ue(self, value: int):
+        value += 1
+        self.write(0, value.bit_length() - 1)
+        self.write(value, value.bit_length())
+
+    def bytes(self):
+        # rbsp_stop_one_bit 与字节对齐
+        bits = self.bits + [1] + [0] * (-(len(self.bits) + 1) % 8)
+        return bytes(int("".join(map(str, bits[index:index + 8])), 2) for index in range(0, len(bits), 8))
+
+
+def _sps(width: int, height: int):
+    """
+        Baseline profile SPS，分辨率为16的倍数
+    """
+    writer = BitWriter()
+    writer.write(66, 8)  # profile_idc
+    writer.write(0, 8)
+    writer.write(30, 8)  # level_idc
+    for value in (0, 0, 0, 0, 1):  # sps_id / log2_max_frame_num / poc_type / log2_max_poc_lsb / max_num_ref_frames
+        writer.ue(value)
+    writer.write(0, 1)
+    writer.ue(width // 16 - 1)
+    writer.ue(height // 16 - 1)
+    writer.write(0b1100, 4)  # frame_mbs_only / direct_8x8_inference / frame_cropping / vui_parameters_present
+    return b"\x67" + writer.bytes()
+
+
+def _crc32_mpeg(data: bytes):
+
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc ^= byte << 24
+        for _ in range(8):
+            crc = (crc << 1 ^ 0x04C11DB7 if crc & 0x80000000 else crc << 1) & 0xFFFFFFFF
+    return crc
+
+
+def _section(table_id: int, table_ext: int, body: bytes):
+
+    section = struct.pack(">BHHBBB", table_id, 0xB000 | len(body) + 9, table_ext, 0xC1, 0, 0) + body
+    return b"\x00" + section + struct.pack(">I", _crc32_mpeg(section))
+
+
+def _timestamp(prefix: int, value: int):
+    return bytes((prefix << 4 | value >> 29 & 0x0E | 1, value >> 22 & 0xFF, value >> 14 & 0xFE | 1, value >> 7 & 0xFF, value << 1 & 0xFE | 1))
+
+
+def _packets(pid: int, payload: bytes, counters: dict):
+    """
+        把一个PES或PSI切分为TS包，最后一个包用adaptation field填充
+    """
+    packets = []
+    for start in range(0, len(payload), 184):
+        chunk = payload[start:start + 184]
+        counter = counters.get(pid, 0)
+        counters[pid] = (counter + 1) % 16
+        header = struct.pack(">BHB", 0x47, (0x4000 if start == 0 else 0) | pid, counter)
+
+        if len(chunk) < 184:
+            stuffing = 183 - len(chunk)
+            header = header[:3] + bytes((0x30 | counter, stuffing)) + (b"\x00" + b"\xff" * (stuffing - 1) if stuffing else b"")
+        else:
+            header = header[:3] + bytes((0x10 | counter,))
+
+        packets.append(header + chunk)
+    return packets
+
+
+def make_ts(size: int):
+    """
+        生成约 size 字节的H.264/AAC MPEG-TS，编码数据为不含0的随机字节（不会出现起始码）
+
+        Returns:
+            tuple: (ts, 每条track期望的 [帧数, 帧数据md5])，帧数据与MP4中的sample一致：视频为长度前缀的NAL（不含AUD），音频为去掉ADTS头的AAC帧
+    """
+    rng = random.Random(size)
+    counters = {}
+    sps, pps = _sps(320, 240), b"\x68\xce\x38\x80"
+    pat = _section(0, 1, struct.pack(">HH", 1, 0xE000 | PMT_PID))
+    pmt = _section(2, 1, struct.pack(">HH", 0xE000 | VIDEO_PID, 0xF000) + struct.pack(">BHH", 0x1B, 0xE000 | VIDEO_PID, 0xF000)
+                   + struct.pack(">BHH", 0x0F, 0xE000 | AUDIO_PID, 0xF000))
+
+    video, audio = hashlib.md5(), hashlib.md5()
+    video_frames = audio_frames = 0
+    packets = []
+
+    def noise(count: int):
+        return bytes(rng.randrange(1, 256) for _ in range(count))
+
+    while len(packets) * 188 < size:
+        frame = video_frames
+        if frame % GOP == 0:
+            packets += _packets(0, pat, counters) + _packets(PMT_PID, pmt, counters)
+
+        # 视频：每帧一个PES，pts比dts晚两帧
+        dts = 90000 + frame * 90000 // FPS
+        nals = [sps, pps, b"\x65" + noise(rng.randrange(6000, 12000))] if frame % GOP == 0 else [b"\x41" + noise(rng.randrange(1000, 4000))]
+        video.update(b"".join(struct.pack(">I", len(nal)) + nal for nal in nals))
+        video_frames += 1
+
+        header = b"\x80\xc0\x0a" + _timestamp(3, dts + 2 * 90000 // FPS) + _timestamp(1, dts)
+        es = b"".join(b"\x00\x00\x00\x01" + nal for nal in [b"\x09\xf0"] + nals)
+        packets += _packets(VIDEO_PID, b"\x00\x00\x01\xe0\x00\x00" + header + es, counters)
+
+        # 音频：每个PES包含到下一视频帧为止的若干ADTS帧
+        frames = []
+        while audio_frames * 1024 * FPS < (frame + 1) * SAMPLE_RATE:
+            data = noise(rng.randrange(200, 400))
+            length = len(data) + 7
+            frames.append(bytes((0xFF, 0xF1, 1 << 6 | 4 << 2, 2 << 6 | length >> 11, length >> 3 & 0xFF, (length & 7) << 5 | 0x1F, 0xFC)) + data)
+            audio.update(data)
+            audio_frames += 1
+        if frames:
+            pts = 90000 + (audio_frames - len(frames)) * 1024 * 90000 // SAMPLE_RATE
+            es = b"\x80\x80\x05" + _timestamp(2, pts) + b"".join(frames)
+            packets += _packets(AUDIO_PID, b"\x00\x00\x01\xc0" + struct.pack(">H", len(es)) + es, counters)
+
+    return b"".join(packets), {"video": [video_frames, video.hexdigest()], "audio": [audio_frames, audio.hexdigest()]}
+
+
+def _boxes(data: bytes, start: int = 0, end: int = None):
+
+    end = len(data) if end is None else end
+    while start + 8 <= end:
+        size, kind = struct.unpack(">I4s", data[start:start + 8])
+        yield kind, start, start + size
+        start += size
+
+
+def check_mp4(path: Path):
+    """
+        统计fragmented MP4中每条track的帧数与帧数据
+
+        Returns:
+            dict: video / audio => [帧数, 帧数据md5]，与 make_ts 的返回值比较
+    """
+    data = path.read_bytes()
+    kinds = {}
+    result = {}
+
+    for kind, start, end in _boxes(data):
+        if kind == b"moov":
+            for trak, trak_start, trak_end in _boxes(data, start + 8, end):
+                if trak != b"trak":
+                    continue
+                children = {name: (s, e) for name, s, e in _boxes(data, trak_start + 8, trak_end)}
+                track_id = struct.unpack(">I", data[children[b"tkhd"][0] + 20:children[b"tkhd"][0] + 24])[0]
+                mdia = {name: s for name, s, e in _boxes(data, children[b"mdia"][0] + 8, children[b"mdia"][1])}
+                handler = data[mdia[b"hdlr"] + 16:mdia[b"hdlr"] + 20]
+                kinds[track_id] = "video" if handler == b"vide" else "audio"
+                result[kinds[track_id]] = [0, hashlib.md5()]
+
+        elif kind == b"moof":
+            for traf, traf_start, traf_end in _boxes(data, start + 8, end):
+                if traf != b"traf":
+                    continue
+                children = {name: s for name, s, e in _boxes(data, traf_start + 8, traf_end)}
+                track = result[kinds[struct.unpack(">I", data[children[b"tfhd"] + 12:children[b"tfhd"] + 16])[0]]]
+
+                trun = children[b"trun"]
+                flags = struct.unpack(">I", data[trun + 8:trun + 12])[0] & 0xFFFFFF
+                count, offset = struct.unpack(">Ii", data[trun + 12:trun + 20])
+                entry = 4 * bin(flags & 0xF00).count("1")
+                offset += start
+                for index in range(count):
+                    # sample_duration 之后为 sample_size
+                    size_pos = trun + 20 + index * entry + (4 if flags & 0x100 else 0)
+                    sample_size = struct.unpack(">I", data[size_pos:size_pos + 4])[0]
+                    track[1].update(data[offset:offset + sample_size])
+                    offset += sample_size
+                track[0] += count
+
+    return {kind: [count, md5.hexdigest()] for kind, (count, md5) in result.items()}
+
+
+class MockCDN(object):
+
+    def __init__(self, size: int, segment_size: int, latency: float = 0, bandwidth: int = 0, fault: float = 0, plaintext: bytes = None):
+        """
+            模拟CDN
+
+            Args:
+                size (int): 视频明文大小（字节），指定 plaintext 时忽略
+                segment_size (int): HLS分片大小（字节），需为188的整数倍
+                latency (float): 每个请求的首字节延迟（秒）
+                bandwidth (int): 单连接带宽上限（字节/秒），0 为不限制
+                fault (float): 视频数据请求出错的概率，一半返回503，一半只返回一半数据后断开
+                plaintext (bytes): 视频明文，默认为随机字节
+        """
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.fault = fault
+
+        # 整个ts文件：IV + AES-CBC(明文 + \0填充)，随机明文每188字节以TS同步字节开头，通过解密后的校验
+        if plaintext is None:
+            plaintext = bytearray(os.urandom(size))
+            plaintext[::188] = b"\x47" * len(range(0, size, 188))
+            plaintext = bytes(plaintext)
+        self.plaintext = plaintext
+        size = len(self.plaintext)
+        iv = os.urandom(AES.block_size)
+        padding = b"\0" * (-size % AES.block_size)
+        self.ts = iv + AES.new(KEY, AES.MODE_CBC, iv).encrypt(self.plaintext + padding)
+
+        # HLS分片：以序号为IV，PKCS7填充
+        self.segments = []
+        for sequence, start in enumerate(range(0, size, segment_size)):
+            cipher = AES.new(KEY, AES.MODE_CBC, sequence.to_bytes(AES.block_size, "big"))
+            self.segments.append(cipher.encrypt(pad(self.plaintext[start:start + segment_size], AES.block_size)))
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    @property
+    def digest(self):
+        return hashlib.md5(self.plaintext).hexdigest()
+
+    def playlist(self):
+
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-MEDIA-SEQUENCE:0",
+                 '#EXT-X-KEY:METHOD=AES-128,URI="https://ke.qq.com/cgi-bin/qcloud/get_dk?fileId=1"']
+        for index in range(len(self.segments)):
+            lines += ["#EXTINF:10.0,", f"seg/{index}.ts?sign=s"]
+        lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines)
+
+    def routes(self, path: str):
+        """
+            Returns:
+                tuple: (body, 是否为视频数据)
+        """
+        if path.startswith("/cgi-bin/qcloud/get_token"):
+            result = {"exper": 0, "sign": "sign", "t": "t", "us": "us"}
+            return json.dumps({"result": result, "retcode": "0"}).encode(), False
+
+        if path.startswith("/getplayinfo/"):
+            transcode = {"url": f"{self.url}/video.m3u8?sign=s", "duration": 600, "size": len(self.ts), "totalSize": len(self.ts)}
+            video_info = {"basicInfo": {"name": "benchmark"}, "transcodeList": [transcode]}
+            return json.dumps({"code": 0, "message": "", "videoInfo": video_info}).encode(), False
+
+        if path.startswith("/cgi-bin/qcloud/get_dk"):
+            return KEY, False
+
+        if path.startswith("/video.m3u8"):
+            return self.playlist().encode(), False
+
+        if path.startswith("/video.ts"):
+            return self.ts, True
+
+        match = re.match(r"/seg/(\d+)\.ts", path)
+        if match:
+            return self.segments[int(match.group(1))], True
+
+        return None, False
+
+    def _handler(self):
+
+        cdn = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+
+                time.sleep(cdn.latency)
+
+                body, media = cdn.routes(self.path)
+                if body is None:
+                    self.send_error(404)
+                    return
+
+                fault = media and random.random() < cdn.fault
+                if fault and random.random() < 0.5:
+                    self.send_error(503)
+                    return
+
+                if media and self.headers.get("Range"):
+                    start, stop = re.match(r"bytes=(\d+)-(\d*)", self.headers["Range"]).groups()
+                    start, stop = int(start), int(stop) if stop else len(body) - 1
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{stop}/{len(body)}")
+                    body = body[start:stop + 1]
+                else:
+                    self.send_response(200)
+
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+
+                # 出错时只发送一半数据后断开
+                if fault:
+                    body = body[:len(body) // 2]
+                    self.close_connection = True
+
+                step = 64 * 1024
+                try:
+                    for start in range(0, len(body), step):
+                        self.wfile.write(body[start:start + step])
+                        if cdn.bandwidth:
+                            time.sleep(step / cdn.bandwidth)
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+
+
+class MockTransport(httpx.AsyncBaseTransport):
+
+    def __init__(self, base_url: str):
+        """
+            将 ke.qq.com / playvideo.qcloud.com 等接口请求转发到本地模拟CDN
+        """
+        self.base_url = httpx.URL(base_url)
+        self.transport = httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request):
+        request.url = request.url.copy_with(scheme=self.base_url.scheme, host=self.base_url.host, port=self.base_url.port)
+        return await self.transport.handle_async_request(request)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def _io_written():
+    """
+        本进程通过write系统调用写出的字节数，仅Linux可用
+    """
+    try:
+        for line in Path("/proc/self/io").read_text().splitlines():
+            if line.startswith("wchar:"):
+                return int(line.split()[1])
+    except OSError:
+        return None
+
+
+def _peak_rss():
+    """
+        本进程的峰值内存，Linux下ru_maxrss会继承exec前父进程的值，优先读取VmHWM
+    """
+    try:
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_trial(config: dict):
+    """
+        子进程中执行一次完整下载，工作目录为临时目录
+
+        Returns:
+            dict: 各阶段耗时、峰值内存、写入字节数、结果是否正确
+    """
+    import asyncio
+
+    sys.path.insert(0, str(Path(__file__).parent))
+
+    import downloader
+    from main import TaskUrls
+    from hls import HlsDownloader
+    from models import TaskInfoItem
+    from retry import RetryPolicy
+
+    downloader.CHUNK_SIZE = config["chunk_size"]
+
+    Path("Cache").mkdir()
+    Path("Cache/token.json").write_text(json.dumps({"uin": "0", "ext": "bench"}))
+    Path("Cache/cookies.json").write_text("[]")
+
+    remux = config.get("remux") is not None
+    task = TaskInfoItem(
+        create_time=0, csid=0, endtime=0, resid_ext="", term_id=1, type=2, bgtime=0,
+        name="benchmark", resid_list="1", aid=0, taid="1", cid=1, download_path=Path("Data/benchmark.mp4" if remux else "Data/benchmark.ts")
+    )
+    hls = config["mode"] == "hls"
+    retry = RetryPolicy(base_delay=0.1)
+    written = _io_written()
+
+    async def main():
+        start = time.perf_counter()
+        async with httpx.AsyncClient(transport=MockTransport(config["url"])) as client:
+            url, key, total_size = await TaskUrls(task, hls).get(client)
+        resolved = time.perf_counter()
+
+        if hls:
+            download = HlsDownloader(url=url, key=key, file_path=task.download_path, thread_num=config["threads"], retry=retry,
+                                     remux=remux)
+        else:
+            download = downloader.AsyncDownloader(url=url, key=key, file_path=task.download_path, file_size=total_size,
+                                                  thread_num=config["threads"], retry=retry, remux=remux)
+        await download.main_download()
+        downloaded = time.perf_counter()
+
+        download._finish()
+        finished = time.perf_counter()
+
+        return resolved - start, downloaded - resolved, finished - downloaded, finished - start
+
+    resolve, download, finish, total = asyncio.run(main())
+    peak_rss = _peak_rss()
+
+    if remux:
+        ok = check_mp4(task.download_path) == config["remux"]
+    else:
+        md5 = hashlib.md5()
+        with open(task.download_path, "rb") as f:
+            for block in iter(lambda: f.read(MB), b""):
+                md5.update(block)
+        ok = md5.hexdigest() == config["digest"]
+
+    return {
+        "resolve": resolve,
+        "download": download,
+        "finish": finish,
+        "total": total,
+        "peak_rss": peak_rss,
+        "disk_written": None if written is None else _io_written() - written,
+        "ok": ok,
+    }
+
+
+def import_time(modules: str):
+    """
+        在新的解释器中用 -X importtime 统计导入耗时
+
+        Returns:
+            tuple: (总耗时（毫秒）, 耗时最多的模块 [(累计耗时, 模块名)])
+    """
+    code = "; ".join(f"import {module}" for module in modules.split(","))
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=Path(__file__).parent, capture_output=True, text=True, check=True
+    )
+
+    # import time: self [us] | cumulative | imported package
+    # 子模块先于父模块输出，顶层模块没有缩进，只统计要检查的模块，不计入解释器启动时导入的site等
+    total = 0
+    slowest = []
+    children = []
+    for line in process.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)", line)
+        if not match:
+            continue
+
+        cumulative, indent, name = int(match.group(2)) / 1000, match.group(3), match.group(4)
+        if indent:
+            children.append((cumulative, name))
+            continue
+
+        if name in modules.split(","):
+            total += cumulative
+            slowest += children + [(cumulative, name)]
+        children = []
+
+    return total, sorted(slowest, reverse=True)[:10]
+
+
+def check_import_budget(modules: str, budget: float):
+    """
+        导入耗时超出预算时返回非0，防止启动时又导入了playwright、pydantic等较慢的依赖
+    """
+    # 取多次中最快的一次，减少磁盘缓存的影响
+    results = [import_time(modules) for _ in range(3)]
+    total, slowest = min(results)
+
+    print(f"import {modules}: {total:.1f}ms (预算 {budget:g}ms)")
+    for cumulative, name in slowest:
+        print(f"{cumulative:>10.1f}ms  {name}")
+
+    return 0 if total <= budget else 1
+
+
+def percentile(values, p: float):
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values) + 0.5) - 1))]
+
+
+def run_strategy(cdn: MockCDN, mode: str, threads: int, chunk_size: int, repeat: int, remux: dict = None):
+
+    config = {"url": cdn.url, "digest": cdn.digest, "mode": mode, "threads": threads, "chunk_size": chunk_size, "remux": remux}
+    trials = []
+
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as work_dir:
+            output = subprocess.run(
+                [sys.executable, str(Path(__file__).absolute()), "--worker", json.dumps(config)],
+                cwd=work_dir, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True
+            ).stdout
+        trials.append(json.loads(output.strip().splitlines()[-1]))
+
+    totals = [trial["total"] for trial in trials]
+    written = [trial["disk_written"] for trial in trials if trial["disk_written"] is not None]
+
+    return {
+        "mode": mode,
+        "threads": threads,
+        "chunk_mb": chunk_size / MB,
+        "throughput_mb": len(cdn.plaintext) / MB / percentile(totals, 50),
+        "p50": percentile(totals, 50),
+        "p99": percentile(totals, 99),
+        "resolve": percentile([trial["resolve"] for trial in trials], 50),
+        "finish": percentile([trial["finish"] for trial in trials], 50),
+        "peak_rss_mb": max(trial["peak_rss"] for trial in trials) / MB,
+        "disk_written_mb": max(written) / MB if written else None,
+        "ok": all(trial["ok"] for trial in trials),
+    }
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="本地模拟CDN的下载性能测试")
+    parser.add_argument("--size", type=int, default=64, help="视频大小（MB）")
+    parser.add_argument("--segment-size", type=float, default=2, help="HLS分片大小（MB）")
+    parser.add_argument("--latency", type=float, default=0, help="每个请求的首字节延迟（毫秒）")
+    parser.add_argument("--bandwidth", type=int, default=0, help="单连接带宽上限（KB/s），0 为不限制")
+    parser.add_argument("--fault", type=float, default=0, help="请求出错概率")
+    parser.add_argument("--modes", default="range,hls", help="下载模式，逗号分隔：range,hls")
+    parser.add_argument("--threads", default="4,20", help="最大连接数，逗号分隔")
+    parser.add_argument("--chunk-sizes", default="1,4", help="range模式分块大小（MB），逗号分隔")
+    parser.add_argument("--repeat", type=int, default=3, help="每种策略重复次数")
+    parser.add_argument("--remux", action="store_true", help="使用生成的H.264/AAC TS，下载时转为MP4并检查帧数")
+    parser.add_argument("--output", help="结果另存为json")
+    parser.add_argument("--import-budget", type=float, help="只检查导入耗时（毫秒），超出时返回1")
+    parser.add_argument("--import-modules", default="main,cli", help="检查导入耗时的模块，逗号分隔")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_trial(json.loads(args.worker))))
+        return
+
+    if args.import_budget is not None:
+        sys.exit(check_import_budget(args.import_modules, args.import_budget))
+
+    # HLS分片按TS包对齐，--remux时分片边界落在PES中间
+    segment_size = int(args.segment_size * MB)
+    segment_size -= segment_size % 188
+    plaintext = expected = None
+    if args.remux:
+        plaintext, expected = make_ts(args.size * MB)
+        print(f"生成TS: {len(plaintext) / MB:.1f}MB 视频{expected['video'][0]}帧 音频{expected['audio'][0]}帧")
+
+    cdn = MockCDN(args.size * MB, segment_size, args.latency / 1000, args.bandwidth * 1024, args.fault, plaintext)
+    cdn.start()
+
+    strategies = []
+    for mode in args.modes.split(","):
+        # 分块大小只影响range模式
+        chunk_sizes = args.chunk_sizes.split(",") if mode == "range" else args.chunk_sizes.split(",")[:1]
+        for threads in args.threads.split(","):
+            for chunk_size in chunk_sizes:
+                strategies.append((mode, int(threads), int(float(chunk_size) * MB)))
+
+    results = []
+    header = f"{'mode':<6}{'conn':>5}{'chunk':>7}{'MB/s':>9}{'p50(s)':>9}{'p99(s)':>9}{'resolve':>9}{'finish':>8}{'RSS(MB)':>9}{'write(MB)':>10}  ok"
+    print(header)
+    print("-" * len(header))
+
+    for mode, threads, chunk_size in strategies:
+        result = run_strategy(cdn, mode, threads, chunk_size, args.repeat, expected)
+        results.append(result)
+
+        written = "-" if result["disk_written_mb"] is None else f"{result['disk_written_mb']:.1f}"
+        print(f"{mode:<6}{threads:>5}{result['chunk_mb']:>7g}{result['throughput_mb']:>9.1f}{result['p50']:>9.2f}{result['p99']:>9.2f}"
+              f"{result['resolve']:>9.3f}{result['finish']:>8.3f}{result['peak_rss_mb']:>9.1f}{written:>10}  {result['ok']}")
+
+    cdn.stop()
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=4))
+
+    # 结果不正确时返回非0，便于在CI中发现回归
+    sys.exit(0 if all(result["ok"] for result in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
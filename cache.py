@@ -0,0 +1,141 @@
+import json
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Optional
+
+
+CACHE_PATH = Path('Cache/meta.db')
+
+# 各类接口响应的有效期（秒）
+COURSE_TTL = 60 * 60            # basic_info 课程信息，新课时一般按周更新
+TOKEN_TTL = 10 * 60             # get_token 签名参数
+PLAYINFO_TTL = 10 * 60          # getplayinfo 中的地址带签名
+M3U8_TTL = 10 * 60              # m3u8 中的key地址带token
+KEY_TTL = 7 * 24 * 60 * 60      # 视频解密密匙，同一视频不变
+
+# 缓存总大小上限，超出时按最近访问时间淘汰
+MAX_SIZE = 64 * 1024 * 1024
+# 清理过期记录的最短间隔（秒）
+EVICT_INTERVAL = 10 * 60
+# 超出上限时淘汰到上限的该比例，避免缓存满后每次写入都淘汰
+EVICT_RATIO = 0.8
+
+
+class MetaCache(object):
+
+    def __init__(self, path: Path = CACHE_PATH, max_size: int = MAX_SIZE):
+        """
+            本地接口响应缓存（SQLite），按 kind + key 存取，每条记录有独立的过期时间
+
+            事件循环与解析课程的线程共用一个连接，所有操作加线程锁；
+            使用WAL且不在每次提交时同步磁盘，写入只在估计的总大小超出上限或距上次清理超过 EVICT_INTERVAL 时才清理
+
+            Args:
+                path (Path): 数据库路径
+                max_size (int): 缓存总大小上限（字节）
+        """
+        self.path = path
+        self.max_size = max_size
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+        # 估计的总大小（替换记录时偏大，清理时重新统计）与上次清理时间
+        self._size = 0
+        self._evicted = 0.0
+
+    @property
+    def conn(self):
+        # 首次使用时才创建数据库，调用方需持有 self._lock
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "kind TEXT, key TEXT, value BLOB, size INTEGER, expires REAL, accessed REAL, "
+                "PRIMARY KEY (kind, key))"
+            )
+            self._size = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+            self._evicted = time.time()
+            self._conn = conn
+        return self._conn
+
+    def get(self, kind: str, key: Any) -> Optional[bytes]:
+
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT value FROM cache WHERE kind = ? AND key = ? AND expires > ?", (kind, str(key), now)
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            with self.conn:
+                self.conn.execute("UPDATE cache SET accessed = ? WHERE kind = ? AND key = ?", (now, kind, str(key)))
+        return row[0]
+
+    def set(self, kind: str, key: Any, value: bytes, ttl: int):
+
+        now = time.time()
+        with self._lock:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?)",
+                    (kind, str(key), value, len(value), now + ttl, now)
+                )
+            self._size += len(value)
+
+            if self._size > self.max_size or now - self._evicted > EVICT_INTERVAL:
+                self._evict(now)
+
+    def delete(self, kind: str, key: Any):
+
+        with self._lock:
+            with self.conn:
+                self.conn.execute("DELETE FROM cache WHERE kind = ? AND key = ?", (kind, str(key)))
+
+    def get_json(self, kind: str, key: Any):
+        value = self.get(kind, key)
+        return None if value is None else json.loads(value)
+
+    def set_json(self, kind: str, key: Any, value, ttl: int):
+        self.set(kind, key, json.dumps(value).encode(), ttl)
+
+    def _evict(self, now: float):
+        """
+            删除过期记录，总大小超出上限时按最近访问时间从旧到新淘汰，调用方需持有 self._lock
+        """
+        self._evicted = now
+        with self.conn:
+            self.conn.execute("DELETE FROM cache WHERE expires <= ?", (now,))
+
+            total = self._size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+            if total <= self.max_size:
+                return
+
+            target = self.max_size * EVICT_RATIO
+            rows = self.conn.execute("SELECT kind, key, size FROM cache ORDER BY accessed").fetchall()
+            for kind, key, size in rows:
+                self.conn.execute("DELETE FROM cache WHERE kind = ? AND key = ?", (kind, key))
+                total -= size
+                if total <= target:
+                    break
+            self._size = total
+
+    def clear(self):
+
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+            # WAL模式下还有 -wal / -shm 文件
+            for path in (self.path, self.path.with_name(self.path.name + "-wal"), self.path.with_name(self.path.name + "-shm")):
+                path.unlink(missing_ok=True)
+
+
+meta_cache = MetaCache()
@@ -0,0 +1,260 @@
+"""
+    无交互的批量下载入口，适合定时任务
+
+    按命令行参数或manifest文件选择课程，多个课程同时下载，全程不需要输入
+
+    Usage:
+        python cli.py --cid 12345 --cid 67890 --term 100 --chapter 200
+        python cli.py --manifest jobs.json --dry-run
+        python cli.py --manifest jobs.json --sync
+        python cli.py --manifest jobs.json --disk-budget 20000000000 --order shortest
+
+    manifest格式（见 models.ManifestModel）:
+        {"root": "Data", "course_num": 2, "courses": [{"cid": 12345, "terms": [100], "chapters": []}]}
+
+    退出码:
+        0 全部完成  1 有视频或课程下载失败  2 参数或manifest错误  3 未登录或登录状态失效  130 被中断
+"""
+from __future__ import annotations
+
+import sys
+import json
+import asyncio
+import argparse
+from typing import TYPE_CHECKING, List, Tuple
+
+from login import Login
+from session import session
+from limiter import RateLimiter
+from sync import CourseSnapshot
+from planner import ORDERS, Planner
+from progress import Progress, format_size
+from main import Course, Download
+
+if TYPE_CHECKING:
+    from models import ManifestCourse, ManifestModel, TaskInfoItem
+
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_LOGIN = 3
+EXIT_INTERRUPTED = 130
+
+
+class Batch(object):
+
+    def __init__(self, manifest: ManifestModel, dry_run: bool = False, sync: bool = False, metrics_log: str = None, metrics_port: int = 0):
+        """
+            按manifest批量下载多个课程
+
+            Args:
+                manifest (ManifestModel): 课程与下载参数
+                dry_run (bool, optional): 只列出将要下载的视频和大小. Defaults to False.
+                sync (bool, optional): 与上次同步的快照对比，只下载新增或改变的视频. Defaults to False.
+                metrics_log (str, optional): 见Download. Defaults to None.
+                metrics_port (int, optional): 见Download. Defaults to 0.
+        """
+        self.manifest = manifest
+        self.dry_run = dry_run
+        self.sync = sync
+        self.metrics_log = metrics_log
+        self.metrics_port = metrics_port
+
+        # 所有课程共用带宽和连接数，显示整批的汇总进度
+        self.limiter = RateLimiter(manifest.rate_limit, manifest.max_connections)
+        self.progress = Progress()
+
+        # 失败的课程或视频
+        self.failed: List[str] = []
+
+    async def _load(self, item: ManifestCourse) -> Tuple[Course, List[TaskInfoItem]]:
+
+        course = await asyncio.to_thread(Course, self.manifest.root, item.cid)
+        tasks = course.select(item.terms, item.chapters)
+
+        # 已存在判断、同步快照都按最终的mp4文件
+        if self.manifest.remux:
+            for task in tasks:
+                task.download_path = task.download_path.with_suffix(".mp4")
+
+        return course, tasks
+
+    @property
+    def planning(self):
+        # 指定了预算或排序时下载前先规划
+        manifest = self.manifest
+        return self.dry_run or manifest.disk_budget or manifest.time_budget or manifest.order != "course"
+
+    async def _plan(self, course: Course, tasks: List[TaskInfoItem], changed: List[TaskInfoItem] = ()):
+        """
+            获取课程下所有视频的清晰度列表，按预算选择清晰度并排序，dry-run时只输出规划
+
+            changed中的视频即使本地已存在也会重新下载
+
+            Returns:
+                Planner
+        """
+        manifest = self.manifest
+        planner = Planner(tasks, manifest.hls, manifest.bandwidth or manifest.rate_limit)
+        await planner.fetch(redownload=changed)
+
+        if not planner.choose(manifest.disk_budget, manifest.time_budget):
+            print(f"[{course.course_name}] 所有视频降到最低清晰度仍超出预算，共 {format_size(planner.total_size)}")
+
+        if self.dry_run:
+            planner.report(f"[{course.cid}] {course.course_name} 共:{len(tasks)} 个视频")
+            self.failed.extend(planner.failed)
+
+        return planner
+
+    async def _run_course(self, item: ManifestCourse, semaphore: asyncio.Semaphore):
+
+        async with semaphore:
+            try:
+                course, tasks = await self._load(item)
+            except Exception as e:
+                self.failed.append(str(item.cid))
+                print(f"获取课程信息失败 => [{item.cid}]\n报错信息:{e}")
+                return
+
+            snapshot = None
+            if self.sync:
+                snapshot = CourseSnapshot(course.cid)
+                tasks = snapshot.diff(tasks)
+                # 已删除的视频只需要taid，从原始数据统计，不展开整个课程
+                taids = set(course.course_data.taids())
+                removed = [taid for taid in snapshot.tasks if taid not in taids]
+                print(f"[{course.course_name}] 新增:{len(snapshot.added)} 改变:{len(snapshot.changed)} 已删除:{len(removed)}")
+
+            planner = None
+            if self.planning and tasks:
+                planner = await self._plan(course, tasks, snapshot.changed if snapshot else ())
+
+            if self.dry_run:
+                return
+
+            if snapshot:
+                snapshot.prepare()
+                if not tasks:
+                    return
+
+            if planner:
+                tasks = planner.order(self.manifest.order)
+
+            print(f"[{course.course_name}] 共:{len(tasks)} 个视频等待下载...")
+            download = Download(
+                tasks, video_num=self.manifest.video_num, hls=self.manifest.hls, remux=self.manifest.remux, limiter=self.limiter,
+                metrics_log=self.metrics_log, metrics_port=self.metrics_port, on_done=snapshot.mark if snapshot else None,
+                progress=self.progress, resolutions=planner.resolutions() if planner else None
+            )
+            await download.main_download()
+            self.failed.extend(download.failed)
+
+    async def main_download(self):
+
+        semaphore = asyncio.Semaphore(self.manifest.course_num)
+
+        if not self.dry_run:
+            self.progress.start()
+        try:
+            await asyncio.gather(*[self._run_course(item, semaphore) for item in self.manifest.courses])
+        finally:
+            self.progress.stop()
+
+    def main(self):
+
+        asyncio.run(self.main_download())
+
+        if self.failed:
+            print(f"以下 {len(self.failed)} 项失败：")
+            for name in self.failed:
+                print(f"  {name}")
+            return EXIT_FAILED
+
+        return EXIT_OK
+
+
+def load_manifest(args: argparse.Namespace):
+    """
+        读取manifest文件，命令行参数覆盖文件中的设置
+    """
+    from models import ManifestModel
+
+    data = {}
+    if args.manifest:
+        with open(args.manifest, encoding='utf-8') as f:
+            data = json.load(f)
+
+    if args.cid:
+        data["courses"] = [{"cid": cid, "terms": args.term, "chapters": args.chapter} for cid in args.cid]
+
+    for name in ("root", "course_num", "video_num", "max_connections", "rate_limit", "order", "disk_budget", "time_budget", "bandwidth"):
+        if getattr(args, name) is not None:
+            data[name] = getattr(args, name)
+    if args.hls:
+        data["hls"] = True
+    if args.remux:
+        data["remux"] = True
+
+    return ManifestModel(**data)
+
+
+def main(argv: List[str] = None):
+
+    parser = argparse.ArgumentParser(description="腾讯课堂无交互批量下载")
+    parser.add_argument("--manifest", help="manifest文件路径（json）")
+    parser.add_argument("--cid", type=int, action="append", default=[], help="课程cid，可重复")
+    parser.add_argument("--term", type=int, action="append", default=[], help="只下载该term_id，可重复")
+    parser.add_argument("--chapter", type=int, action="append", default=[], help="只下载该章节ch_id，可重复")
+    parser.add_argument("--root", help="下载文件夹，默认Data")
+    parser.add_argument("--course-num", type=int, help="同时下载的课程数")
+    parser.add_argument("--video-num", type=int, help="每个课程同时下载的视频数")
+    parser.add_argument("--max-connections", type=int, help="所有课程共用的最大连接数")
+    parser.add_argument("--rate-limit", type=int, help="所有课程共用的带宽上限（字节/秒），0 为不限制")
+    parser.add_argument("--hls", action="store_true", help="按m3u8分片下载")
+    parser.add_argument("--remux", action="store_true", help="边下载边转为mp4，不需要再用ffmpeg转换")
+    parser.add_argument("--dry-run", action="store_true", help="只列出将要下载的视频、每档清晰度的大小和预计耗时")
+    parser.add_argument("--order", choices=ORDERS, help="下载顺序：课程顺序/小文件优先/大文件优先")
+    parser.add_argument("--disk-budget", type=int, help="每个课程的磁盘预算（字节），超出时降低部分视频的清晰度")
+    parser.add_argument("--time-budget", type=int, help="每个课程的下载时间预算（秒），需要 --bandwidth 或 --rate-limit")
+    parser.add_argument("--bandwidth", type=int, help="预计带宽（字节/秒），用于估算耗时，默认使用 --rate-limit")
+    parser.add_argument("--sync", action="store_true", help="只下载上次同步后新增或改变的视频")
+    parser.add_argument("--metrics-log", help="下载事件JSON-lines日志路径")
+    parser.add_argument("--metrics-port", type=int, default=0, help="提供Prometheus /metrics 的端口")
+    args = parser.parse_args(argv)
+
+    if not args.manifest and not args.cid:
+        parser.print_usage()
+        print("需要指定 --cid 或 --manifest")
+        return EXIT_USAGE
+
+    try:
+        manifest = load_manifest(args)
+    except (OSError, ValueError) as e:  # pydantic的ValidationError也是ValueError
+        print(f"manifest错误：{e}")
+        return EXIT_USAGE
+
+    if manifest.time_budget and not (manifest.bandwidth or manifest.rate_limit):
+        print("--time-budget 需要同时指定 --bandwidth 或 --rate-limit")
+        return EXIT_USAGE
+
+    # 无交互运行，无法扫码登陆
+    if not Login.is_login():
+        print("未检测到cookies或token pattern，请先执行 python main.py 扫码登录")
+        return EXIT_LOGIN
+
+    # 登录状态快过期时先无窗口刷新，刷新失败需要重新扫码
+    if session.is_expired():
+        session.refresh()
+        if session.expired:
+            return EXIT_LOGIN
+
+    try:
+        return Batch(manifest, args.dry_run, args.sync, args.metrics_log, args.metrics_port).main()
+    except KeyboardInterrupt:
+        return EXIT_INTERRUPTED
+
+
+if __name__ == '__main__':
+    sys.exit(main())
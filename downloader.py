@@ -1,173 +1,717 @@
 from pathlib import Path
-from tqdm import tqdm
-from typing import List
+from typing import Awaitable, Callable, Deque, Dict, List
+from functools import partial
+from collections import deque
+from concurrent.futures import Executor
+import json
+import time
+import hashlib
 import httpx
 import asyncio
 from Crypto.Cipher import AES
 
+from retry import RetryPolicy
+from limiter import RateLimiter
+from metrics import metrics
+from writer import AsyncWriter
+from progress import Progress
+from remux import TsRemuxer, TS_SYNC_BYTE
+
+
+# 分块大小，断点续传日志按块记录校验值（需为AES块大小的整数倍）
+CHUNK_SIZE = 1024 * 1024
+# 任务队列中每个区间包含的块数
+SPAN_CHUNKS = 4
+# 初始连接数，之后根据吞吐量增减
+INITIAL_THREAD = 4
+# 吞吐量采样间隔（秒）
+MONITOR_INTERVAL = 1
+# 攒够多少密文后交给线程池解密一次
+DECRYPT_BATCH = 256 * 1024
+# 每个区间攒够多少明文（或写满一块）后交给I/O线程写入一次
+WRITE_BATCH = 1024 * 1024
+# 断点续传日志每完成多少块或间隔多少秒保存一次，结束时再保存一次；中断时未保存的块重新下载
+JOURNAL_BATCH = 64
+JOURNAL_INTERVAL = 5
+
+
+class StreamDecryptor(object):
+
+    def __init__(self, key: bytes):
+        """
+            AES-CBC 流式解密
+            首个块为IV，之后按块对齐解密，不足一个块的数据留到下次
+
+            Args:
+                key (bytes): 解密密匙
+        """
+        self.key = key
+        self.cipher = None
+        self.buffer = b""
+
+    def update(self, data: bytes) -> bytes:
+
+        self.buffer += data
+
+        if self.cipher is None:
+            if len(self.buffer) < AES.block_size:
+                return b""
+            self.cipher = AES.new(self.key, AES.MODE_CBC, self.buffer[:AES.block_size])
+            self.buffer = self.buffer[AES.block_size:]
+
+        size = len(self.buffer) - len(self.buffer) % AES.block_size
+        block, self.buffer = self.buffer[:size], self.buffer[size:]
+
+        return self.cipher.decrypt(block)
+
+
+class FileSizeError(Exception):
+    """
+        服务器返回的文件大小与预期不一致
+    """
+
+
+class DecryptError(Exception):
+    """
+        解密后的数据不是TS（首字节不是同步字节0x47），密匙与视频不匹配
+    """
+
+
+class RangeNotSupported(Exception):
+    """
+        服务器没有按Range请求返回206，整个响应不能按区间写入
+    """
+
 
 class AsyncDownloader(object):
 
-    def __init__(self, *, url: str, key_url: str, file_path: Path, thread_num: int = 20):
+    def __init__(self, *, url: str, key: bytes, file_path: Path, file_size: int = 0, thread_num: int = 20, limiter: RateLimiter = None,
+                 executor: Executor = None, retry: RetryPolicy = None, refresh: Callable[[], Awaitable[str]] = None, progress: Progress = None,
+                 remux: bool = False):
         """
             Async Download
+            构造时不发起网络请求，文件大小未知时在开始下载时通过Range请求获取
+            已知大小时直接开始下载，首个响应的 Content-Range 与之不一致时按实际大小重新开始
 
             Args:
-                thread_num (int): async num
+                thread_num (int): 最大连接数
                 url (str): download url
-                key_url(str): key url to decrypt ts video
+                key (bytes): key to decrypt ts video
                 filepath (str): Path
+                file_size (int): 预估的文件大小，来自 TranscodeListItem.totalSize，0 为未知
+                    用于预分配和分块，以首个响应 Content-Range 中的实际大小为准
+                limiter (RateLimiter): 多个视频共享的带宽与连接数限制，默认仅按 thread_num 限制本视频连接数
+                executor (Executor): 解密使用的线程池，pycryptodome解密时释放GIL，默认使用事件循环的默认线程池
+                retry (RetryPolicy): 重试策略，多个视频可共享全局重试次数
+                refresh (Callable): 下载地址过期时调用，返回新的下载地址
+                progress (Progress): 多个视频共用的汇总进度，默认只显示本视频的进度
+                remux (bool): 按顺序完成的块随下载转为fragmented MP4，file_path 为最终的mp4文件，见 remux.TsRemuxer
         """
 
         self.file_path = file_path
         self.filename = file_path.stem
+        self.part_path = file_path.parent.joinpath(f"{file_path.name}.part")
+        self.journal_path = file_path.parent.joinpath(f"{file_path.name}.journal")
+        self.remux_path = file_path.parent.joinpath(f"{file_path.name}.remux")
 
         self.url = url
-        self.key_url = key_url
+        self.key = key
         self.client = httpx.AsyncClient()
         self.thread_num = thread_num
+        self.limiter = limiter or RateLimiter(max_connections=thread_num)
+        self.executor = executor
+        self.retry = retry or RetryPolicy()
+        self.refresh = refresh
+        self.refresh_lock = asyncio.Lock()
+        self.own_progress = progress is None
+        self.progress = progress or Progress(1)
+
+        # 调度状态
+        self.queue: Deque[List[int]] = deque()
+        self.running: Dict[int, List[int]] = {}
+        self.workers: List[asyncio.Task] = []
+        self.retire = 0
+        self.downloaded = 0
+
+        # 统计
+        self.retries = 0
+        self.decrypt_time = 0.0
+
+        # 转换MP4：已交给remuxer的连续块数
+        self.remux = remux
+        self.remuxer = None
+        self.remux_chunk = 0
+        self._remux_files = None
+
+        # 日志中未保存的块数与上次保存时间，只在I/O线程中修改
+        self._unsaved = 0
+        self._saved_at = 0.0
 
-        self.file_size = self._get_file_size()
-        self.cut_info = self._cutting()
+        self._create_folder()
 
-        # Progress Bar
-        self.tqdm_obj: tqdm = tqdm(total=self.file_size, unit_scale=True, unit_divisor=1024, unit="B")
+        # 上次中断时的日志记录的是实际大小，优先于预估
+        # size_confirmed: 已有响应的 Content-Range 与 file_size 一致；actual_size: 不一致时响应中的实际大小
+        self.size_confirmed = False
+        self.actual_size = None
+        self.file_size = 0
+        file_size = self._journal_size() or file_size
+        if file_size:
+            self._set_file_size(file_size)
+
+    def _journal_size(self):
+
+        if self.part_path.exists() and self.journal_path.exists():
+            try:
+                return json.loads(self.journal_path.read_text())["file_size"]
+            except (ValueError, KeyError):
+                return 0
+        return 0
+
+    def _set_file_size(self, file_size: int):
+        """
+            按文件大小建立日志和预分配输出文件，与已有日志不一致时重新开始
+        """
+        # 预估的大小不准确时重新设置，先从进度中减去之前计入的大小
+        if self.file_size:
+            self.progress.add_total(-self.body_size, -self._done_size())
 
-        self._create_folder()
+        self.file_size = file_size
+        # 解密后的大小（去掉首个IV块，未去除末尾填充）
+        self.body_size = self.file_size - AES.block_size
+        self.chunk_num = -(-self.body_size // CHUNK_SIZE)
+
+        self.journal = self._load_journal()
+
+        # 进度按解密后的字节计数
+        self.progress.add_total(self.body_size, self._done_size())
 
     def _create_folder(self):
         """
             Create folder path
         """
-        if not self.file_path.parent.parent.exists():
-            self.file_path.parent.parent.mkdir()
+        # 下载文件夹可能不存在，多个视频可能同时创建同一文件夹
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
 
-        if not self.file_path.parent.exists():
-            self.file_path.parent.mkdir()
+    @staticmethod
+    def _parse_total_size(response: httpx.Response):
+        """
+            从 Content-Range: bytes 0-0/123456 中获取文件总大小
+        """
+        total = response.headers.get("Content-Range", "").rpartition("/")[2]
+        return int(total) if total.isdigit() else None
 
-    def _get_file_size(self):
+    async def _get_file_size(self, url: str):
+        """
+            通过Range请求获取实际的文件大小
+        """
+        async with self.client.stream("GET", url, headers={'Range': 'bytes=0-0'}) as response:
+            response.raise_for_status()
+            return self._check_range(response)
 
-        with httpx.stream("GET", self.url) as res:
-            size = int(res.headers["Content-Length"])
-            return size
+    def _check_range(self, response: httpx.Response):
+        """
+            只接受带 Content-Range 的206响应，返回其中的文件总大小
+        """
+        size = self._parse_total_size(response)
+        if response.status_code != 206 or size is None:
+            raise RangeNotSupported(f"{self.filename} 服务器未按Range请求返回206: {response.status_code}")
+        return size
 
-    def _cutting(self):
+    def _check_size(self, total_size: int):
         """
-        切割成若干份
-        :param file_size: 下载文件大小
-        :param thread_num: 线程数量
-        :return:
-        :[0, 31409080],
-        :[31409081, 62818160],
-        :[62818161, 94227240],
-        :[94227241, 125636320],
-        :[125636321, 157045400],
-        :[157045401, 188454480],
-        :[188454481, 219863560],
-        :[219863561, 251272640],
-        :[251272641, 282681720],
-        :[282681721, '-']]
-        """
-        cut_info: List[List[int | str]] = []
-        cut_size = self.file_size // self.thread_num
-
-        for num in range(self.thread_num):
-            cut_info.append([cut_size*num + 1, cut_size * (num + 1)])
-
-            if num == self.thread_num - 1:
-                cut_info[-1][1] = "-"
-            elif num == 0:
-                cut_info[0][0] = 0
-
-        return cut_info
-
-    def _merge_files(self):
-        """
-        合并分段下载的文件
-        :param file_path:
+            响应中的文件大小与 file_size 不一致时，首次确认前记录实际大小，由main_download重新开始；确认之后再改变则放弃
+        """
+        if total_size is None:
+            return
+        if total_size != self.file_size:
+            if not self.size_confirmed:
+                self.actual_size = total_size
+            raise FileSizeError(f"{self.filename} 文件大小不一致: {total_size} != {self.file_size}")
+        self.size_confirmed = True
+
+    def _make_queue(self):
+        """
+        将未完成的块切割成若干份，每份最多 SPAN_CHUNKS 个连续块（闭区间）
         :return:
+        :[0, 3],
+        :[4, 7],
+        :[9, 12],
+        ...
+        :[296, 299]]
+        """
+        queue: Deque[List[int]] = deque()
+
+        for chunk in range(self.chunk_num):
+            if self._is_done(chunk):
+                continue
+            if queue and queue[-1][1] == chunk - 1 and chunk - queue[-1][0] < SPAN_CHUNKS:
+                queue[-1][1] = chunk
+            else:
+                queue.append([chunk, chunk])
+
+        return queue
+
+    def _next_span(self):
+        """
+            从队列中取下一个区间，队列为空时拆分剩余最多的进行中区间
+
+            Returns:
+                List[int] | None: [start_chunk, stop_chunk]，无可分配时为None
+        """
+        if self.queue:
+            return self.queue.popleft()
+
+        # 进行中的区间 span[0] 为正在写入的块，之后的块可被拆分
+        victim = max(self.running.values(), key=lambda span: span[1] - span[0], default=None)
+        if victim is None or victim[1] - victim[0] < 1:
+            return None
+
+        mid = victim[1] - (victim[1] - victim[0] + 1) // 2 + 1
+        span = [mid, victim[1]]
+        victim[1] = mid - 1
+        return span
+
+    def _load_journal(self):
+        """
+            读取断点续传日志，校验已完成块的md5，校验失败的块重新下载
+            日志与输出文件不匹配时重新预分配输出文件
+
+            journal:
+                file_size (int): 文件大小
+                chunk_size (int): 分块大小
+                stage (str): downloading 下载中 / decrypted 全部块已解密写入，等待去除填充并重命名
+                chunks (dict): 已完成的块序号 => md5
+
+            Returns:
+                dict: journal
+        """
+        if self.part_path.exists() and self.journal_path.exists():
+            journal = json.loads(self.journal_path.read_text())
+
+            if journal["file_size"] == self.file_size and journal["chunk_size"] == CHUNK_SIZE:
+                if journal["stage"] == "decrypted":
+                    return journal
+
+                if self.part_path.stat().st_size == self.body_size:
+                    journal["chunks"] = self._verify_chunks(journal["chunks"])
+                    self.journal = journal
+                    self._save_journal()
+                    return journal
+
+        # 预分配输出文件
+        with open(self.part_path.absolute(), 'wb') as f:
+            f.truncate(self.body_size)
+
+        self.journal = {"file_size": self.file_size, "chunk_size": CHUNK_SIZE, "stage": "downloading", "chunks": {}}
+        self._save_journal()
+        return self.journal
+
+    def _verify_chunks(self, chunks: Dict[str, str]):
+
+        verified = {}
+
+        with open(self.part_path.absolute(), 'rb') as f:
+            for chunk, md5 in chunks.items():
+                f.seek(int(chunk) * CHUNK_SIZE)
+                if hashlib.md5(f.read(self._chunk_size(int(chunk)))).hexdigest() == md5:
+                    verified[chunk] = md5
+
+        return verified
+
+    def _save_journal(self):
+        """
+            先写临时文件再替换，避免中断时日志损坏
+        """
+        temp_path = self.journal_path.with_name(self.journal_path.name + ".tmp")
+        temp_path.write_text(json.dumps(self.journal))
+        temp_path.replace(self.journal_path)
+
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+
+    def _flush_journal(self):
+        if self._unsaved:
+            self._save_journal()
+
+    def _is_done(self, chunk: int):
+        return str(chunk) in self.journal["chunks"]
+
+    def _mark_done(self, chunk: int, md5: str):
+        """
+            在I/O线程中记录已写入的块，每 JOURNAL_BATCH 块或 JOURNAL_INTERVAL 秒保存一次日志
+            每次保存都写出整个日志，逐块保存时总写入量随文件大小平方增长
         """
+        self.journal["chunks"][str(chunk)] = md5
+        self._unsaved += 1
+        if self._unsaved >= JOURNAL_BATCH or time.monotonic() - self._saved_at >= JOURNAL_INTERVAL:
+            self._save_journal()
 
-        with open(self.file_path.absolute(), 'ab') as f_count:
-            for index in range(self.thread_num):
+        if self.remux:
+            self._remux_ready()
 
-                sub_file = self.file_path.parent.joinpath(f"{index}_{self.file_path.name}")
+    def _remux_ready(self):
+        """
+            按顺序把从头开始连续完成的块交给remuxer，转换结果追加到 .remux 文件
+            在I/O线程中执行，此时之前提交的数据已写入；中断后重新开始时从头转换 .part 中已完成的块
+        """
+        if self.remuxer is None:
+            self.remuxer = TsRemuxer()
+            self._remux_files = (open(self.part_path.absolute(), 'rb'), open(self.remux_path.absolute(), 'wb'))
+
+        source, target = self._remux_files
+        while self.remux_chunk < self.chunk_num and self._is_done(self.remux_chunk):
+            source.seek(self.remux_chunk * CHUNK_SIZE)
+            target.write(self.remuxer.feed(source.read(self._chunk_size(self.remux_chunk))))
+            self.remux_chunk += 1
+
+    def _close_remux(self):
 
-                with open(sub_file.absolute(), 'rb') as sub_write:
-                    f_count.write(sub_write.read())
+        if self._remux_files:
+            for f in self._remux_files:
+                f.close()
+        self.remuxer = None
+        self.remux_chunk = 0
+        self._remux_files = None
 
-                # 合并完成删除子文件
-                sub_file.unlink()
+    def _chunk_size(self, chunk: int):
+        return min(CHUNK_SIZE, self.body_size - chunk * CHUNK_SIZE)
 
-        return
+    def _done_size(self):
+        return sum(self._chunk_size(chunk) for chunk in range(self.chunk_num) if self._is_done(chunk))
 
-    def _decrypt_ts(self):
+    @staticmethod
+    def _strip_padding(f):
+        """
+            去除文件末尾的\0填充，等同于对整个明文 rstrip(b"\0")
+        """
+        pos = f.seek(0, 2)
 
-        def decrypt(content, key):
-            iv = content[:AES.block_size]
-            cipher = AES.new(key, AES.MODE_CBC, iv)
-            plaintext = cipher.decrypt(content[AES.block_size:])
-            return plaintext.rstrip(b"\0")
+        while pos > 0:
+            step = min(CHUNK_SIZE, pos)
+            f.seek(pos - step)
+            stripped = f.read(step).rstrip(b"\0")
+            pos = pos - step + len(stripped)
+            if stripped:
+                break
 
-        key = httpx.get(self.key_url).content
+        f.truncate(pos)
 
-        with open(self.file_path.absolute(), 'rb') as f:
-            content = f.read()
+    def _finish(self):
+        """
+            所有块写入完成后去除填充，重命名为最终文件并删除日志
+            最终文件只会由完整的 .part 原子重命名得到
+        """
+        if self._done_size() != self.body_size:
+            raise Exception(f"{self.filename} 下载未完成，请重新运行以继续下载")
 
-        decrypted_ts = decrypt(content, key)
-        with open(self.file_path.absolute(), 'wb') as f:
-            f.write(decrypted_ts)
+        if self.remux:
+            with metrics.timer("finish", video=self.filename):
+                self._finish_remux()
+            return
 
-    async def downloader(self, index, start_size, stop_size, retry=False):
+        with metrics.timer("finish", video=self.filename):
+            # 去除填充后文件大小改变，之后中断只需重新执行这一步
+            self.journal["stage"] = "decrypted"
+            self._save_journal()
 
-        sub_file = self.file_path.parent.joinpath(f"{index}_{self.file_path.name}")
+            with open(self.part_path.absolute(), 'rb+') as f:
+                self._strip_padding(f)
 
-        if sub_file.exists():
-            temp_size = sub_file.stat().st_size  # 本地已经下载的文件大小
-            if not retry:
-                self.tqdm_obj.update(temp_size)  # 更新下载进度条
-        else:
-            temp_size = 0
+            self.part_path.replace(self.file_path)
+            self.journal_path.unlink()
 
-        stop_size = "" if stop_size == '-' else stop_size
+    def _finish_remux(self):
+        """
+            转换剩余的块，MP4原子重命名为最终文件后删除 .part 和日志
+            末尾的填充不足一个TS包，转换时自动丢弃
+        """
+        try:
+            self._remux_ready()
+            self._remux_files[1].write(self.remuxer.close())
+        finally:
+            self._close_remux()
 
-        headers = {'Range': f'bytes={start_size + temp_size}-{stop_size}'}
+        self.remux_path.replace(self.file_path)
+        self.part_path.unlink()
+        self.journal_path.unlink()
 
-        down_file = open(sub_file.absolute(), 'ab')
+    def _write(self, span, plaintext: bytes, written: int, md5, buffer: bytearray):
+        """
+            明文先放入区间的 buffer，攒够 WRITE_BATCH 或写满一块时交给I/O线程写入
+            写满一块时推进 span[0]，该块写入磁盘后再在I/O线程中记录校验值、标记完成
+
+            Returns:
+                tuple: (当前块已接收的大小, 当前块的md5对象)
+        """
+        # CBC解密不校验密匙，用错密匙时只会得到乱码，首块解密后检查TS同步字节
+        if span[0] == 0 and written == 0 and plaintext and plaintext[0] != TS_SYNC_BYTE:
+            raise DecryptError(f"{self.filename} 解密后不是TS数据，密匙与视频不匹配")
+
+        while plaintext and span[0] <= span[1]:
+            chunk_size = self._chunk_size(span[0])
+            data = plaintext[:chunk_size - written]
+            plaintext = plaintext[len(data):]
+            buffer += data
+            md5.update(data)
+            written += len(data)
+            self.downloaded += len(data)
+            self.progress.update(len(data))
+
+            if written == chunk_size or len(buffer) >= WRITE_BATCH:
+                self.writer.write(span[0] * CHUNK_SIZE + written - len(buffer), bytes(buffer))
+                buffer.clear()
+
+            if written == chunk_size:
+                self.writer.submit(partial(self._mark_done, span[0], md5.hexdigest()))
+                span[0] += 1
+                written = 0
+                md5 = hashlib.md5()
+
+        return written, md5
+
+    async def _download_span(self, url: str, span):
+        """
+            发起一次Range请求下载区间 span 内的块，span[0] 随下载推进，span[1] 可能被其他worker拆分缩小
+        """
+        # 明文第k块对应密文 [k*CHUNK_SIZE+16, ...)，多请求前一个密文块作为IV
+        start_size = span[0] * CHUNK_SIZE
+        stop_size = min((span[1] + 1) * CHUNK_SIZE + AES.block_size, self.file_size) - 1
+        headers = {'Range': f'bytes={start_size}-{stop_size}'}
+
+        decryptor = StreamDecryptor(self.key)
+        written = 0  # 当前块已接收的大小
+        md5 = hashlib.md5()
+        pending = bytearray()  # 当前块还未交给I/O线程的明文
+
+        first_chunk = span[0]
+        received = 0
+        ttfb = None
+        status = "error"
+        begin = time.perf_counter()
 
         try:
-            async with self.client.stream("GET", self.url, headers=headers) as response:
-                num_bytes_downloaded = response.num_bytes_downloaded
+            async with self.client.stream("GET", url, headers=headers) as response:
+                ttfb = time.perf_counter() - begin
+                # 预估偏大时区间可能超出实际文件，416响应的 Content-Range 为 bytes */实际大小
+                if response.status_code == 416:
+                    self._check_size(self._parse_total_size(response))
+                response.raise_for_status()
+
+                # 200时响应是整个文件，写入 span[0] 处会损坏文件且校验值会记入日志
+                self._check_size(self._check_range(response))
+
+                buffer = bytearray()
                 async for chunk in response.aiter_bytes():
-                    if chunk:
-                        down_file.write(chunk)
-                        self.tqdm_obj.update(response.num_bytes_downloaded - num_bytes_downloaded)
-                        num_bytes_downloaded = response.num_bytes_downloaded
+                    await self.limiter.consume(len(chunk))
+                    received += len(chunk)
+                    buffer += chunk
+                    if len(buffer) < DECRYPT_BATCH:
+                        continue
+
+                    plaintext = await self._decrypt(decryptor, bytes(buffer))
+                    buffer.clear()
+                    written, md5 = self._write(span, plaintext, written, md5, pending)
+
+                    # 磁盘跟不上时在这里等待，不阻塞事件循环
+                    await self.writer.wait()
+
+                    # 剩余部分已被其他worker接手
+                    if span[0] > span[1]:
+                        break
+                else:
+                    plaintext = await self._decrypt(decryptor, bytes(buffer))
+                    written, md5 = self._write(span, plaintext, written, md5, pending)
+
+            if span[0] <= span[1]:
+                raise httpx.RemoteProtocolError("响应数据不完整")
+
+            status = "ok"
 
-        except Exception as e:
-            print("{}:请求超时,尝试重连\n报错信息:{}".format(index, e))
-            await self.downloader(index, start_size, stop_size, retry=True)
+        except Exception:
+            self.progress.update(-written)  # 未完成的块重新下载
+            self.downloaded -= written
+            raise
 
         finally:
-            down_file.close()
+            duration = time.perf_counter() - begin
+            metrics.emit("range", video=self.filename, status=status, start_chunk=first_chunk, chunks=span[0] - first_chunk,
+                         bytes=received, ttfb=ttfb, duration=duration, throughput=received / duration if duration else 0)
 
-        return
+    async def _decrypt(self, decryptor: StreamDecryptor, data: bytes):
+
+        start = time.perf_counter()
+        plaintext = await asyncio.get_running_loop().run_in_executor(self.executor, decryptor.update, data)
+        self.decrypt_time += time.perf_counter() - start
+        return plaintext
+
+    async def _refresh_url(self, failed_url: str):
+        """
+            地址过期时重新获取，多个区间同时过期时只刷新一次
+        """
+        async with self.refresh_lock:
+            if self.url == failed_url:
+                self.url = await self.refresh()
+
+    def _on_retry(self, message: str):
+        self.retries += 1
+        self.progress.log(message)
+
+    async def _call(self, request: Callable[[str], Awaitable], label, progress: Callable[[], int] = None):
+        """
+            以当前下载地址调用 request，失败时按 RetryPolicy 重试，地址过期时刷新后重试
+        """
+        url = None
+
+        async def action():
+            nonlocal url
+            url = self.url
+            return await request(url)
+
+        refresh = (lambda: self._refresh_url(url)) if self.refresh else None
+        return await self.retry.call(action, video=self.filename, label=label, refresh=refresh, progress=progress,
+                                     on_retry=self._on_retry)
+
+    async def downloader(self, index, span):
+        """
+            下载区间 span，失败时按 RetryPolicy 退避重试，只重新请求未完成的块
+        """
+        async def request(url: str):
+            # 剩余部分可能已被其他worker接手
+            if span[0] <= span[1]:
+                await self._download_span(url, span)
+
+        await self._call(request, index, progress=lambda: span[0])
+
+    async def _probe_size(self):
+        """
+            文件大小未知时通过Range请求获取，失败时按 RetryPolicy 重试
+        """
+        return await self._call(self._get_file_size, "文件大小")
+
+    async def worker(self, index):
+
+        while True:
+            if self.retire > 0:
+                self.retire -= 1
+                return
+
+            span = self._next_span()
+            if span is None:
+                return
+
+            async with self.limiter.connection():
+                self.running[index] = span
+                try:
+                    await self.downloader(index, span)
+                finally:
+                    del self.running[index]
+
+    def _add_worker(self):
+        self.workers.append(asyncio.create_task(self.worker(len(self.workers))))
+
+    async def _monitor(self):
+        """
+            根据吞吐量增减连接数：
+            吞吐量随新连接明显提升时继续增加，明显下降时减少一个连接
+        """
+        best_rate = 0.0
+
+        while True:
+            pending = [worker for worker in self.workers if not worker.done()]
+            if not pending:
+                return
+
+            # 有worker失败时不再等待其他worker，由main_download处理
+            if any(not worker.cancelled() and worker.exception() for worker in self.workers if worker.done()):
+                return
+
+            last_size, last_time = self.downloaded, time.monotonic()
+            await asyncio.wait(pending, timeout=MONITOR_INTERVAL)
+            rate = (self.downloaded - last_size) / (time.monotonic() - last_time)
+            active = len(pending) - self.retire
+
+            if rate > best_rate * 1.1:
+                best_rate = rate
+                if active < self.thread_num and (self.queue or self.running):
+                    self._add_worker()
+            elif rate < best_rate * 0.5 and active > 1:
+                self.retire += 1
+                best_rate = rate
+
+    async def _restart(self):
+        """
+            预估的大小与实际不一致时停止所有worker，等已提交的写入完成后按实际大小重建日志和输出文件
+        """
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+
+        # 之前的块写入与记录日志都在I/O线程中，完成后再重建，避免写入新的日志
+        await self.writer.drain()
+        self._close_remux()
+
+        self.progress.log(f"{self.filename} 实际大小与预估不一致: {self.actual_size} != {self.file_size}，重新开始")
+        self._set_file_size(self.actual_size)
+
+        self.actual_size = None
+        self.workers = []
+        self.running = {}
+        self.retire = 0
 
     async def main_download(self):
 
-        index = 0
-        tasks = []
-        for info in self.cut_info:
-            task = asyncio.create_task(self.downloader(index, info[0], info[1]))
-            tasks.append(task)
-            index += 1
+        begin = time.perf_counter()
+        self.writer = AsyncWriter(self.part_path)
+
+        # 单独使用时自己显示进度，批量下载时由Download统计
+        if self.own_progress:
+            self.progress.start_video()
+            self.progress.start()
+
+        ok = False
+        try:
+            # 只有大小未知时才单独请求，否则直接下载，由首个响应的 Content-Range 校验
+            if not self.file_size:
+                self._set_file_size(await self._probe_size())
+
+            while True:
+                self.queue = self._make_queue()
+
+                for _ in range(min(INITIAL_THREAD, self.thread_num)):
+                    self._add_worker()
+
+                try:
+                    await self._monitor()
+                    await asyncio.gather(*self.workers)
+                    break
+                except Exception:
+                    if self.actual_size is None:
+                        raise
+                    await self._restart()
+
+            ok = True
+        finally:
+            for worker in self.workers:
+                worker.cancel()
+
+            # 等待剩余数据写入磁盘、日志记录完成，保存剩余的日志
+            if self.file_size:
+                self.writer.submit(self._flush_journal)
+            await self.writer.close()
+            await self.client.aclose()
+
+            # 失败后重新下载时从头转换
+            if not ok:
+                self._close_remux()
+
+            if self.own_progress:
+                self.progress.finish_video(ok)
+                self.progress.stop()
 
-        await asyncio.gather(*tasks)
-        await self.client.aclose()
+        metrics.emit("video", video=self.filename, mode="range", bytes=self.downloaded, duration=time.perf_counter() - begin,
+                     decrypt=self.decrypt_time, retries=self.retries, connections=len(self.workers))
 
     def main(self):
 
         asyncio.run(self.main_download())
-        self.tqdm_obj.close()
-        self._merge_files()
-        self._decrypt_ts()
+        self._finish()
@@ -0,0 +1,348 @@
+import re
+import json
+import time
+import asyncio
+import httpx
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+from functools import partial
+from concurrent.futures import Executor
+from urllib.parse import urljoin
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import unpad
+
+from models import HlsSegment
+from retry import RetryPolicy
+from limiter import RateLimiter
+from metrics import metrics
+from writer import AsyncWriter
+from progress import Progress
+from remux import TsRemuxer, TS_SYNC_BYTE
+from downloader import DecryptError
+
+
+def parse_playlist(text: str, base_url: str):
+    """
+        解析m3u8 media playlist
+
+        Args:
+            text (str): m3u8内容
+            base_url (str): m3u8地址，用于拼接相对的分片地址
+
+        Returns:
+            List[HlsSegment]
+    """
+    segments: List[HlsSegment] = []
+    sequence = 0
+    duration = 0.0
+    key_uri = None
+    iv = None
+
+    for line in text.splitlines():
+        line = line.strip()
+
+        if line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+            sequence = int(line.split(":", 1)[1])
+
+        elif line.startswith("#EXT-X-KEY:"):
+            attrs = dict(re.findall(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)', line.split(":", 1)[1]))
+            attrs = {name: value.strip('"') for name, value in attrs.items()}
+            if attrs.get("METHOD", "NONE") == "NONE":
+                key_uri, iv = None, None
+            else:
+                key_uri = urljoin(base_url, attrs["URI"])
+                iv = bytes.fromhex(attrs["IV"][2:]) if "IV" in attrs else None
+
+        elif line.startswith("#EXTINF:"):
+            duration = float(line.split(":", 1)[1].split(",")[0])
+
+        elif line and not line.startswith("#"):
+            segments.append(HlsSegment(url=urljoin(base_url, line), sequence=sequence, duration=duration, key_uri=key_uri, iv=iv))
+            sequence += 1
+
+    return segments
+
+
+class HlsDownloader(object):
+
+    def __init__(self, *, url: str, key: bytes, file_path: Path, file_size: int = 0, thread_num: int = 20, limiter: RateLimiter = None,
+                 executor: Executor = None, retry: RetryPolicy = None, refresh: Optional[Callable[[], Awaitable[str]]] = None,
+                 progress: Progress = None, remux: bool = False):
+        """
+            按m3u8分片并发下载，每个分片独立解密后按顺序写入输出文件
+
+            Args:
+                url (str): m3u8 url（带token）
+                key (bytes): key to decrypt segments，所有加密分片共用，m3u8中有多个密匙时不支持
+                file_path (Path): 输出文件
+                file_size (int): 预计文件大小（TranscodeListItem.totalSize），只用于显示进度，0 为未知
+                thread_num (int): 最大连接数
+                limiter (RateLimiter): 多个视频共享的带宽与连接数限制，默认仅按 thread_num 限制本视频连接数
+                executor (Executor): 解密分片使用的线程池，默认使用事件循环的默认线程池
+                retry (RetryPolicy): 重试策略，多个视频可共享全局重试次数
+                refresh (Callable): 地址过期(401/403)时调用，返回新的m3u8 url，为空时过期直接失败
+                progress (Progress): 多个视频共用的汇总进度，默认只显示本视频的进度
+                remux (bool): 分片解密后直接转为fragmented MP4写入，不落盘TS，file_path 为最终的mp4文件，见 remux.TsRemuxer
+        """
+        self.file_path = file_path
+        self.filename = file_path.stem
+        self.part_path = file_path.parent.joinpath(f"{file_path.name}.part")
+        self.state_path = file_path.parent.joinpath(f"{file_path.name}.state")
+
+        self.url = url
+        self.key = key
+        self.client = httpx.AsyncClient()
+        self.thread_num = thread_num
+        self.limiter = limiter or RateLimiter(max_connections=thread_num)
+        self.executor = executor
+        self.retry = retry or RetryPolicy()
+        self.refresh = refresh
+        self.refresh_lock = asyncio.Lock()
+        self.segments: List[HlsSegment] = []
+        self.file_size = file_size
+        self.remux = remux
+        self.own_progress = progress is None
+        self.progress = progress or Progress(1)
+
+        # 统计
+        self.retries = 0
+        self.decrypt_time = 0.0
+        self.downloaded = 0
+
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+
+    def _load_state(self):
+        """
+            断点续传状态：已按顺序写入的分片数与对应的文件大小
+            转换MP4时还记录已接收的TS大小与remuxer的状态
+
+            Returns:
+                dict: {"segments": int, "size": int, "done": int, "remux": dict}
+        """
+        state = {"segments": 0, "size": 0}
+
+        if self.part_path.exists() and self.state_path.exists():
+            state = json.loads(self.state_path.read_text())
+
+        # 丢弃最后一次保存状态之后写入的不完整数据
+        with open(self.part_path.absolute(), 'ab') as f:
+            f.truncate(state["size"])
+
+        return state
+
+    def _save_state(self, segments: int, size: int, **extra):
+        """
+            先写临时文件再替换，避免中断时状态损坏
+        """
+        temp_path = self.state_path.with_name(self.state_path.name + ".tmp")
+        temp_path.write_text(json.dumps({"segments": segments, "size": size, **extra}))
+        temp_path.replace(self.state_path)
+
+    @staticmethod
+    def _remux(remuxer: TsRemuxer, content: bytes):
+        # 每个分片结束时输出已接收完的sample，未完成的PES记录在状态中，之后可以断点续传
+        return remuxer.feed(content) + remuxer.flush()
+
+    def decrypt(self, segment: HlsSegment, content: bytes):
+
+        if segment.key_uri is None:
+            return content
+
+        iv = segment.iv or segment.sequence.to_bytes(AES.block_size, "big")
+        cipher = AES.new(self.key, AES.MODE_CBC, iv)
+        try:
+            plaintext = unpad(cipher.decrypt(content), AES.block_size)
+        except ValueError:
+            plaintext = b""
+
+        # 密匙不正确时填充校验通常失败，偶尔通过时再检查TS同步字节
+        if plaintext[:1] != bytes([TS_SYNC_BYTE]):
+            raise DecryptError(f"{self.filename} 分片{segment.sequence}解密后不是TS数据，密匙与视频不匹配")
+        return plaintext
+
+    async def _get_playlist(self, url: str):
+
+        response = await self.client.get(url)
+        response.raise_for_status()
+        segments = parse_playlist(response.text, url)
+
+        # 只传入了一个密匙，分片使用不同密匙时无法解密
+        key_uris = {segment.key_uri for segment in segments if segment.key_uri is not None}
+        if len(key_uris) > 1:
+            raise ValueError(f"{self.filename} m3u8中的分片使用了{len(key_uris)}个不同的密匙，不支持下载")
+
+        return segments
+
+    async def _fetch_playlist(self):
+        """
+            获取m3u8并解析分片，失败时按 RetryPolicy 重试，地址过期时刷新后重新获取
+
+            Returns:
+                List[HlsSegment]
+        """
+        async def refresh():
+            self.url = await self.refresh()
+
+        return await self.retry.call(lambda: self._get_playlist(self.url), video=self.filename, label="m3u8",
+                                     refresh=refresh if self.refresh else None, on_retry=self._on_retry)
+
+    async def _refresh_playlist(self, index: int, failed_url: str):
+        """
+            分片地址过期时重新获取m3u8，更新全部分片地址，多个分片同时过期时只刷新一次
+            已写入的分片不受影响，之后从断点继续
+        """
+        async with self.refresh_lock:
+            if self.segments[index].url != failed_url:
+                return
+
+            self.url = await self.refresh()
+            segments = await self._fetch_playlist()
+            if len(segments) != len(self.segments):
+                raise ValueError(f"{self.filename} 刷新后的m3u8分片数不一致: {len(segments)} != {len(self.segments)}")
+            self.segments = segments
+
+    def _on_retry(self, message: str):
+        self.retries += 1
+        self.progress.log(message)
+
+    async def _get_segment(self, segment: HlsSegment):
+
+        content = bytearray()
+        async with self.limiter.connection():
+            begin = time.perf_counter()
+            async with self.client.stream("GET", segment.url) as response:
+                ttfb = time.perf_counter() - begin
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes():
+                    await self.limiter.consume(len(chunk))
+                    content += chunk
+
+        metrics.emit("segment", video=self.filename, sequence=segment.sequence, bytes=len(content), ttfb=ttfb,
+                     duration=time.perf_counter() - begin)
+        self.downloaded += len(content)
+
+        # 各分片互不依赖，在线程池中并行解密
+        begin = time.perf_counter()
+        plaintext = await asyncio.get_running_loop().run_in_executor(self.executor, self.decrypt, segment, bytes(content))
+        self.decrypt_time += time.perf_counter() - begin
+        return plaintext
+
+    async def _download_segment(self, index: int):
+        """
+            下载并解密第 index 个分片，失败时按 RetryPolicy 重试，分片地址过期后重新获取m3u8
+        """
+        failed_url = None
+
+        async def action():
+            nonlocal failed_url
+            segment = self.segments[index]
+            failed_url = segment.url
+            return await self._get_segment(segment)
+
+        refresh = (lambda: self._refresh_playlist(index, failed_url)) if self.refresh else None
+        return await self.retry.call(action, video=self.filename, label=self.segments[index].sequence, refresh=refresh,
+                                     on_retry=self._on_retry)
+
+    async def main_download(self):
+
+        begin = time.perf_counter()
+
+        # 单独使用时自己显示进度，批量下载时由Download统计
+        if self.own_progress:
+            self.progress.start_video()
+            self.progress.start()
+
+        ok = False
+        try:
+            segments = await self._download_segments()
+            ok = True
+        finally:
+            await self.client.aclose()
+
+            if self.own_progress:
+                self.progress.finish_video(ok)
+                self.progress.stop()
+
+        metrics.emit("video", video=self.filename, mode="hls", bytes=self.downloaded, duration=time.perf_counter() - begin,
+                     decrypt=self.decrypt_time, retries=self.retries, segments=len(segments))
+
+    async def _download_segments(self):
+        """
+            下载全部分片并按顺序写入
+
+            Returns:
+                List[HlsSegment]: m3u8中的分片
+        """
+        self.segments = segments = await self._fetch_playlist()
+
+        state = self._load_state()
+        start, size = state["segments"], state["size"]
+
+        # 转换MP4时输出文件大小与接收的TS大小不同，进度按TS计数
+        loop = asyncio.get_running_loop()
+        remuxer = TsRemuxer(state.get("remux")) if self.remux else None
+        done = state.get("done", size)
+
+        # 按明文字节计数，总大小未知时随下载增加
+        expected = max(self.file_size, done)
+        self.progress.add_total(expected, done)
+
+        # 最多预取 window 个分片，限制乱序到达时占用的内存
+        window = self.thread_num * 2
+        pending: Dict[int, asyncio.Task] = {}
+
+        def schedule(index: int):
+            if index < len(segments):
+                pending[index] = asyncio.create_task(self._download_segment(index))
+
+        for index in range(start, start + window):
+            schedule(index)
+
+        # 按顺序交给I/O线程写入，写入后再保存状态
+        writer = AsyncWriter(self.part_path)
+
+        try:
+            for index in range(start, len(segments)):
+                content = await pending.pop(index)
+                schedule(index + window)
+
+                done += len(content)
+                if done > expected:
+                    self.progress.add_total(done - expected)
+                    expected = done
+                self.progress.update(len(content))
+
+                if remuxer:
+                    content = await loop.run_in_executor(self.executor, self._remux, remuxer, content)
+                    if index + 1 == len(segments):
+                        content += remuxer.close()
+
+                writer.write(size, content)
+                size += len(content)
+                if remuxer:
+                    writer.submit(partial(self._save_state, index + 1, size, done=done, remux=remuxer.state()))
+                else:
+                    writer.submit(partial(self._save_state, index + 1, size))
+
+                await writer.wait()
+        finally:
+            for task in pending.values():
+                task.cancel()
+            await writer.close()
+
+        # 完成后按实际大小修正总量
+        self.progress.add_total(done - expected)
+        return segments
+
+    def _finish(self):
+        """
+            所有分片写入完成后删除状态文件并重命名为最终文件
+        """
+        with metrics.timer("finish", video=self.filename):
+            self.state_path.unlink(missing_ok=True)
+            self.part_path.replace(self.file_path)
+
+    def main(self):
+
+        asyncio.run(self.main_download())
+        self._finish()
@@ -0,0 +1,66 @@
+import time
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class RateLimiter(object):
+
+    def __init__(self, rate: int = 0, max_connections: int = 32):
+        """
+            所有下载共享的带宽（令牌桶）与连接数限制，运行中可通过 set_rate / set_max_connections 调整
+
+            Args:
+                rate (int): 总带宽上限（字节/秒），0 为不限制
+                max_connections (int): 总连接数上限
+        """
+        self.rate = rate
+        self.max_connections = max_connections
+
+        # 令牌桶，最多积攒1秒的令牌
+        self.tokens = float(rate)
+        self.last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+        self.active = 0
+        self._cond = asyncio.Condition()
+
+    def set_rate(self, rate: int):
+        self.rate = rate
+        self.tokens = min(self.tokens, float(rate))
+
+    async def set_max_connections(self, max_connections: int):
+        async with self._cond:
+            self.max_connections = max_connections
+            self._cond.notify_all()
+
+    async def consume(self, size: int):
+        """
+            取走 size 字节的令牌，令牌不足时等待，按调用顺序排队保证各下载公平分配带宽
+        """
+        if not self.rate:
+            return
+
+        async with self._lock:
+            now = time.monotonic()
+            self.tokens = min(float(self.rate), self.tokens + (now - self.last) * self.rate)
+            self.last = now
+
+            self.tokens -= size
+            if self.tokens < 0:
+                await asyncio.sleep(-self.tokens / self.rate)
+
+    @asynccontextmanager
+    async def connection(self):
+        """
+            占用一个连接名额，超出上限时等待
+        """
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.active < self.max_connections)
+            self.active += 1
+
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self.active -= 1
+                self._cond.notify()
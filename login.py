@@ -1,40 +1,66 @@
 import re
 import json
 import base64
+import shutil
 from pathlib import Path
-from playwright.sync_api import sync_playwright, Request
+from typing import TYPE_CHECKING
 
+from cache import meta_cache
 
-class Login:
+# 只有扫码登陆时才需要启动浏览器，playwright 在 login() 中导入
+if TYPE_CHECKING:
+    from playwright.sync_api import Request
 
-    def login(self):
 
-        window = sync_playwright().start()
-        browser = window.chromium.launch(channel='msedge', headless=False)
-        context = browser.new_context()
+# 浏览器配置，保存登录状态，之后可不打开窗口刷新cookies与token
+PROFILE_PATH = Path('Cache/browser')
+
 
-        page = context.new_page()
-        page.on("request", self.match_request)
+class LoginExpired(Exception):
+    """
+        保存的登录状态已失效，需要重新扫码登录
+    """
 
-        # Get plan json
-        page.goto("https://ke.qq.com/user/index/index.html")
-        page.wait_for_selector('.login-mask', state='attached')
-        page.wait_for_selector('.login-mask', state='detached', timeout=100000)
-        page.wait_for_selector('.tab-ctn', state='attached')
 
-        # Load a video url to get token pattern
-        page.goto(self.load_initial_url())
-        page.wait_for_selector('#main-video', state='attached')
+class Login:
+
+    def login(self, headless: bool = False):
+        """
+            使用 PROFILE_PATH 中的浏览器配置登陆，保存cookies、token pattern和课程表
 
-        self.save_cookies(page.context.cookies())
+            Args:
+                headless (bool, optional): 不打开窗口，使用保存的登录状态刷新，登录状态失效时抛出LoginExpired. Defaults to False.
+        """
+        from playwright.sync_api import sync_playwright
 
-        page.close()
-        browser.close()
-        window.stop()
+        window = sync_playwright().start()
+        context = window.chromium.launch_persistent_context(PROFILE_PATH.absolute(), channel='msedge', headless=headless)
+
+        try:
+            page = context.new_page()
+            page.on("request", self.match_request)
+
+            # Get plan json
+            page.goto("https://ke.qq.com/user/index/index.html")
+            page.wait_for_selector('.login-mask, .tab-ctn', state='attached')
+            if page.query_selector('.login-mask'):
+                if headless:
+                    raise LoginExpired("登录状态已失效，请执行 python main.py 重新扫码登录")
+                page.wait_for_selector('.login-mask', state='detached', timeout=100000)
+            page.wait_for_selector('.tab-ctn', state='attached')
+
+            # Load a video url to get token pattern
+            page.goto(self.load_initial_url())
+            page.wait_for_selector('#main-video', state='attached')
+
+            self.save_cookies(context.cookies())
+        finally:
+            context.close()
+            window.stop()
 
         print('登录成功')
 
-    def match_request(self, data: Request):
+    def match_request(self, data: "Request"):
         if "vod2.myqcloud.com" in data.url and "token" in data.url:
             self.save_token(data.url)
         elif "get_plan_list" in data.url:
@@ -72,6 +98,12 @@ class Login:
         if play.exists():
             play.unlink()
 
+        # 重新登录时不使用浏览器中保存的登录状态
+        shutil.rmtree(PROFILE_PATH, ignore_errors=True)
+
+        # token与课程表变化后接口缓存随之失效
+        meta_cache.clear()
+
     @staticmethod
     def save_cookies(cookies):
         with open('Cache/cookies.json', 'w') as f:
@@ -109,9 +141,13 @@ class Login:
             f.write(json.dumps(token_dict, indent=4))
 
     @staticmethod
-    def load_token(cid: int, term_id: int):
+    def load_token_fields():
+        return json.loads(Path('Cache/token.json').read_text())
 
-        token = json.loads(Path('Cache/token.json').read_text())
+    @staticmethod
+    def encode_token(fields: dict, cid: int, term_id: int):
+
+        token = dict(fields)
         token['cid'] = cid
         token['term_id'] = term_id
 
@@ -121,6 +157,10 @@ class Login:
 
         return base64.b64encode(token_base[:-1].encode()).decode()
 
+    @staticmethod
+    def load_token(cid: int, term_id: int):
+        return Login.encode_token(Login.load_token_fields(), cid, term_id)
+
     @staticmethod
     def save_plan(plans):
 
@@ -1,26 +1,79 @@
+from __future__ import annotations
+
+import os
 import re
 import json
-import httpx
-from typing import List
+import asyncio
+from typing import TYPE_CHECKING, Callable, Dict, List
 from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from importlib.util import find_spec
+from concurrent.futures import ThreadPoolExecutor
 
 from login import Login
-from downloader import AsyncDownloader
-from models import OPT, ChooseCidModel, CourseModel, Term, ChapterInfoItem, SubInfoItem, TaskInfoItem, TokenResult, VideoInfoModel
+from session import session
+from cache import meta_cache, COURSE_TTL, TOKEN_TTL, PLAYINFO_TTL, M3U8_TTL, KEY_TTL
+from retry import RetryPolicy
+from limiter import RateLimiter
+from metrics import metrics
+from progress import Progress
+from records import OPT, ChooseCidModel, CourseRecord, TermRecord, ChapterRecord, SubRecord, TaskRecord
+
+# httpx、pydantic、Crypto、playwright 导入较慢，用到时才导入，见 benchmark.py --import-budget
+if TYPE_CHECKING:
+    import httpx
+    from models import TaskInfoItem, TokenResult, VideoInfoModel
+
+# 安装了h2时使用HTTP/2复用连接
+HTTP2 = find_spec("h2") is not None
+
+
+def create_client(max_connections: int = 16):
+    """
+        创建解析视频地址共用的连接池client
+    """
+    import httpx
+
+    return httpx.AsyncClient(
+        http2=HTTP2,
+        cookies=session.cookies,
+        limits=httpx.Limits(max_connections=max_connections),
+        timeout=httpx.Timeout(10, read=30),
+    )
+
 
+class TaskUrls(object):
 
-class TaskUrls(Login):
+    # 内存中的密匙缓存，key_url => key，所有视频共用
+    _keys: Dict[str, bytes] = {}
 
-    def __init__(self, task: TaskInfoItem):
+    def __init__(self, task: TaskInfoItem, hls: bool = False, resolution: int = -1):
 
         self.is_valid = True
-        self.RESOLUTION = -1  # 分辨率
+        self.RESOLUTION = resolution  # 分辨率，transcodeList中的下标，见 planner.Planner
+        self.hls = hls  # 返回m3u8地址按分片下载，否则返回整个ts文件地址
 
         self.cid = task.cid
         self.term_id = task.term_id
         self.file_id = self.load_file_id(task)
-        self.cookies = super().load_cookie()
-        self.token = super().load_token(self.cid, self.term_id)
+        self.refreshing = False  # refresh() 中为True，跳过key_url缓存
+
+    @property
+    def token(self):
+        # 登录状态刷新后随之更新
+        return session.token(self.cid, self.term_id)
+
+    @staticmethod
+    def _rendition(url: str):
+        # 清晰度的标识：transcodeList中地址的路径（不含签名），新增清晰度后下标会变化，不能按下标缓存
+        return urlsplit(url).path
+
+    @staticmethod
+    def _key_id(key_url: str):
+        # 去掉token的key_url，作为密匙的磁盘缓存键：key_url不同时不会用到其他清晰度的密匙
+        parts = urlsplit(key_url)
+        query = [(name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True) if name != "token"]
+        return urlunsplit(parts._replace(query=urlencode(query)))
 
     def load_file_id(self, task: TaskInfoItem):
         if task.resid_list:
@@ -31,38 +84,66 @@ class TaskUrls(Login):
             print(f"该课程视频可能未开放播放 => [{task.name}]")
         return file_id
 
-    def check_key_url(self, key_url: str):
+    async def _get_key(self, client: httpx.AsyncClient, key_url: str):
         """
-            Check key_url
+            下载并校验解密密匙
             if response is json this is not a right key url
+
+            Returns:
+                bytes: key
         """
-        try:
-            httpx.get(key_url).json()
-        except:
-            return
+        key = self._keys.get(key_url) or meta_cache.get("key", self._key_id(key_url))
 
-        raise Exception("Token错误，请尝试重新登录")
+        if key is None:
+            key = (await client.get(key_url)).content
+            try:
+                json.loads(key)
+            except:
+                meta_cache.set("key", self._key_id(key_url), key, KEY_TTL)
+            else:
+                raise Exception("Token错误，请尝试重新登录")
+
+        self._keys[key_url] = key
+        return key
 
-    def _get_params(self):
+    async def _get_params(self, client: httpx.AsyncClient):
         # 获得sign, t, us这三个参数
         # 这三个参数用来获取视频m3u8
+        from models import TokenResult
+
         url = 'https://ke.qq.com/cgi-bin/qcloud/get_token'
         params = {
             'term_id': self.term_id,
             'fileId': self.file_id
         }
-        response = httpx.get(url, params=params, cookies=self.cookies).json()
+        cache_key = f"{self.term_id}_{self.file_id}"
+
+        result = meta_cache.get_json("token", cache_key)
+        if result is None:
+            result = (await client.get(url, params=params)).json().get('result')
+            token_result = TokenResult(**result)
+            meta_cache.set_json("token", cache_key, result, TOKEN_TTL)
+            return token_result
 
-        return TokenResult(**response.get('result'))
+        return TokenResult(**result)
 
-    def _get_videoinfo(self, params: TokenResult):
+    async def _get_videoinfo(self, client: httpx.AsyncClient, params: TokenResult):
+
+        from models import VideoInfoModel
 
         url = f'https://playvideo.qcloud.com/getplayinfo/v2/1258712167/{self.file_id}'
-        response = httpx.get(url, params=params.dict(), cookies=self.cookies).json()
+
+        response = meta_cache.get_json("playinfo", self.file_id)
+        if response is None:
+            response = (await client.get(url, params=params.dict())).json()
+            videoinfo = VideoInfoModel(**response)
+            meta_cache.set_json("playinfo", self.file_id, response, PLAYINFO_TTL)
+            return videoinfo
+
         videoinfo = VideoInfoModel(**response)
         return videoinfo
 
-    def _get_download_urls(self, videoinfo: VideoInfoModel):
+    async def _get_download_urls(self, client: httpx.AsyncClient, videoinfo: VideoInfoModel):
         """
             获取该videoinfo下的ts视频下载链接、key密匙下载链接
 
@@ -73,18 +154,29 @@ class TaskUrls(Login):
                 token (str):
 
             Returns:
-                [tuple]: (download_url,key_url)
+                [tuple]: (download_url,key_url,total_size)，total_size 为transcodeList中的预估大小，下载时以服务器返回为准
         """
         # 分辨率
-        ts_url = videoinfo.videoInfo.transcodeList[self.RESOLUTION].url
-        m3u8_text = httpx.get(ts_url + '&token=' + self.token).text
+        transcode = videoinfo.videoInfo.transcodeList[self.RESOLUTION]
+        ts_url = transcode.url
+        rendition = self._rendition(ts_url)
 
-        pattern = re.compile(r'(https://ke.qq.com/cgi-bin/qcloud/get_dk.+)"')
-        return ts_url.replace('.m3u8', '.ts'), pattern.findall(m3u8_text)[0]
+        # 刷新时跳过缓存，重新获取带新token的key_url
+        key_url = None if self.refreshing else meta_cache.get_json("key_url", rendition)
+        if key_url is None:
+            m3u8_text = (await client.get(ts_url + '&token=' + self.token)).text
+            pattern = re.compile(r'(https://ke.qq.com/cgi-bin/qcloud/get_dk.+)"')
+            key_url = pattern.findall(m3u8_text)[0]
+            meta_cache.set_json("key_url", rendition, key_url, M3U8_TTL)
 
-    def get(self):
+        if self.hls:
+            return ts_url + '&token=' + self.token, key_url, transcode.totalSize
+
+        return ts_url.replace('.m3u8', '.ts'), key_url, transcode.totalSize
+
+    async def get(self, client: httpx.AsyncClient):
         """
-            获取视频下载url和key解密url
+            获取视频下载url和解密密匙
 
             From : task =>
             : term_id
@@ -101,31 +193,92 @@ class TaskUrls(Login):
             : ts_url
             : key_url
 
+            From : key_url =>
+            : key
+
             Args:
-                task (TaskInfoItem): 最终选择的课程
+                client (httpx.AsyncClient): 共用的连接池client，见create_client
 
-            Return: (ts_url,key_url)
+            Return: (ts_url,key,total_size)
         """
+        # 长时间的批量下载中登录状态可能过期
+        await session.ensure(client)
 
-        params = self._get_params()
-        videoinfo = self._get_videoinfo(params)
-        ts_url, key_url = self._get_download_urls(videoinfo)
-        self.check_key_url(key_url)
+        with metrics.timer("resolve", step="get_token", file_id=self.file_id):
+            params = await self._get_params(client)
+        with metrics.timer("resolve", step="getplayinfo", file_id=self.file_id):
+            videoinfo = await self._get_videoinfo(client, params)
+        with metrics.timer("resolve", step="m3u8", file_id=self.file_id):
+            ts_url, key_url, total_size = await self._get_download_urls(client, videoinfo)
+        with metrics.timer("resolve", step="get_dk", file_id=self.file_id):
+            key = await self._get_key(client, key_url)
 
-        return ts_url, key_url
+        return ts_url, key, total_size
+
+    async def refresh(self, client: httpx.AsyncClient):
+        """
+            下载地址过期时跳过缓存重新获取
+
+            Return: (ts_url,key,total_size)
+        """
+        meta_cache.delete("token", f"{self.term_id}_{self.file_id}")
+        meta_cache.delete("playinfo", self.file_id)
+
+        self.refreshing = True
+        try:
+            return await self.get(client)
+        finally:
+            self.refreshing = False
+
+    async def transcodes(self, client: httpx.AsyncClient):
+        """
+            只解析各清晰度的大小与时长，不获取下载地址和密匙
+
+            Return: List[TranscodeListItem]
+        """
+        params = await self._get_params(client)
+        videoinfo = await self._get_videoinfo(client, params)
+        return videoinfo.videoInfo.transcodeList
+
+    @classmethod
+    def resolve_all(cls, tasks: List[TaskInfoItem], client: httpx.AsyncClient, limit: int = 8, hls: bool = False,
+                    resolutions: Dict[str, int] = None):
+        """
+            并发解析一批视频的下载地址
+
+            Args:
+                tasks (List[TaskInfoItem]):
+                client (httpx.AsyncClient): 共用的连接池client
+                limit (int, optional): 同时解析的视频数. Defaults to 8.
+                hls (bool, optional): 是否返回m3u8地址. Defaults to False.
+                resolutions (Dict[str, int], optional): taid => transcodeList下标，未指定的视频使用最后一个. Defaults to None.
+
+            Returns:
+                List[asyncio.Task]: 与tasks顺序一致，结果为(ts_url,key,total_size)，视频不可播放时为None
+        """
+        semaphore = asyncio.Semaphore(limit)
+
+        async def _resolve(task: TaskInfoItem):
+            urls = cls(task, hls, (resolutions or {}).get(task.taid, -1))
+            if not urls.is_valid:
+                return None
+            async with semaphore:
+                return await urls.get(client)
+
+        return [asyncio.create_task(_resolve(task)) for task in tasks]
 
 
 class Course(object):
 
     def __init__(self, root_path, cid: int):
         # Initial
-        if not cid:
-            self.cid = self._choose_cid()
+        self.cid = cid if cid else self._choose_cid()
 
         self.root_path = root_path
         self.course_data = self._get_course_data(self.cid)
-        self.course_name = self.course_data.result.course_detail.name
-        self.terms: List[Term] = self.course_data.result.course_detail.terms
+        self.course_name = self.course_data.name
+        self.course_path = Path(self.root_path).joinpath(self._replace_illegal(self.course_name))
+        self.terms: List[TermRecord] = self.course_data.terms
 
     def _choose_menu_index(self, options: List[OPT], is_all=True):
         """
@@ -143,8 +296,8 @@ class Course(object):
         if len(options) == 1:
             return 0
 
-        for item in options:
-            print(str(options.index(item) + 1) + '. ' + item.name)
+        for number, item in enumerate(options, 1):
+            print(str(number) + '. ' + item.name)
 
         while True:
             print("*"*30)
@@ -192,41 +345,47 @@ class Course(object):
 
         url = f'https://ke.qq.com/cgi-bin/course/basic_info?cid={cid}'
         headers = {"referer": f"https://ke.qq.com/course/{cid}"}
-        course_data = CourseModel(**httpx.get(url,headers=headers).json())
 
-        return course_data
+        # 课程树较大，只取出course_detail，选中的部分再校验
+        response = meta_cache.get_json("course", cid)
+        if response is None:
+            import httpx
 
-    def _map_task_path(self, tasks: List[TaskInfoItem]):
-        """
-            根据task taid值寻找父级sub name作为父级文件夹
-            增加对应键download_path
-        """
+            response = httpx.get(url, headers=headers).json()
+            course_data = CourseRecord(self._course_detail(response))
+            meta_cache.set_json("course", cid, response, COURSE_TTL)
+            return course_data
 
-        def _replace_illegal(name: str):
+        course_data = CourseRecord(self._course_detail(response))
 
-            name = re.sub("<|>|/|:|\"|\\*|\\?", "", name)
-            return name.replace("\\", "")
+        return course_data
 
-        _map = {}
+    @staticmethod
+    def _course_detail(response: dict):
 
-        for term in self.terms:
-            for chaper in term.chapter_info:
-                for sub in chaper.sub_info:
-                    for task in sub.task_info:
-                        index = chaper.sub_info.index(sub)
-                        _map.update({task.taid: str(index+1) + "_" + sub.name})
+        try:
+            return response['result']['course_detail']
+        except (KeyError, TypeError):
+            raise Exception(f"获取课程信息失败：{response}")
 
-        for task in tasks:
-            sub_name = _map.get(task.taid, "NotFound")
-            task_path = _replace_illegal(self.course_name) + "/" + _replace_illegal(sub_name)
-            _path = Path(self.root_path).joinpath(task_path).joinpath(task.name+".ts")
-            task.download_path = _path
+    @staticmethod
+    def _replace_illegal(name: str):
+
+        name = re.sub("<|>|/|:|\"|\\*|\\?", "", name)
+        return name.replace("\\", "")
 
+    def _map_task_path(self, sub: SubRecord, tasks: List[TaskRecord]):
+        """
+            以父级sub的序号+name作为父级文件夹，写入task的download_path
+        """
+        sub_path = self.course_path.joinpath(self._replace_illegal(str(sub.index+1) + "_" + sub.name))
+        for task in tasks:
+            task.download_path = sub_path.joinpath(task.name+".ts")
         return tasks
 
     def _get_tasks(self, data: OPT):
         """
-            根据类型判断输入data层级返回该data下所有tasks
+            根据类型判断输入data层级返回该data下所有tasks，只校验选中的tasks
 
             Args:
                 data:OPT
@@ -234,34 +393,30 @@ class Course(object):
             Returns:
                 tasks:list[TaskInfoItem]
         """
-        tasks: List[TaskInfoItem] = []
+        subs: List[SubRecord] = []
 
-        if isinstance(data, Term):
+        if isinstance(data, TermRecord):
             for chaper in data.chapter_info:
-                for subs in chaper.sub_info:
-                    for task in subs.task_info:
-                        tasks.append(task)
+                subs.extend(chaper.sub_info)
 
-        elif isinstance(data, ChapterInfoItem):
-            for subs in data.sub_info:
-                for task in subs.task_info:
-                    tasks.append(task)
+        elif isinstance(data, ChapterRecord):
+            subs.extend(data.sub_info)
 
-        elif isinstance(data, SubInfoItem):
-            for task in data.task_info:
-                tasks.append(task)
+        elif isinstance(data, SubRecord):
+            subs.append(data)
 
-        elif isinstance(data, TaskInfoItem):
-            tasks.append(data)
+        tasks: List[TaskInfoItem] = []
+        for sub in subs:
+            tasks.extend(task.model() for task in self._map_task_path(sub, sub.task_info))
 
-        return self._map_task_path(tasks)
+        return tasks
 
     def main(self):
         # Select Term
         term = self.terms[self._choose_menu_index(self.terms, is_all=False)]
 
         # Select chapter
-        chapters: List[ChapterInfoItem] = term.chapter_info
+        chapters: List[ChapterRecord] = term.chapter_info
         chapter_index = self._choose_menu_index(chapters)
         chapter = chapters[chapter_index]
 
@@ -270,7 +425,7 @@ class Course(object):
             return tasks
 
         # Select sub
-        subs: List[SubInfoItem] = chapter.sub_info
+        subs: List[SubRecord] = chapter.sub_info
         sub_index = self._choose_menu_index(subs)
         sub = subs[sub_index]
 
@@ -279,7 +434,7 @@ class Course(object):
             return tasks
 
         # Select task
-        tasks: List[TaskInfoItem] = sub.task_info
+        tasks: List[TaskRecord] = sub.task_info
         task_index = self._choose_menu_index(tasks)
         task = tasks[task_index]
 
@@ -288,31 +443,186 @@ class Course(object):
             return tasks
 
         # Return single task
-        tasks = self._get_tasks(task)
+        tasks = [task.model() for task in self._map_task_path(sub, [task])]
+        return tasks
+
+    def select(self, term_ids: List[int] = None, chapter_ids: List[int] = None):
+        """
+            不经交互按term_id/ch_id筛选tasks，为空则不筛选
+
+            Args:
+                term_ids (List[int], optional): 只下载这些term. Defaults to None.
+                chapter_ids (List[int], optional): 只下载这些章节. Defaults to None.
+
+            Returns:
+                tasks:list[TaskInfoItem]
+        """
+        tasks: List[TaskInfoItem] = []
+
+        # 未选中的term/chapter不展开
+        for term in self.terms:
+            if term_ids and term.term_id not in term_ids:
+                continue
+            for chaper in term.chapter_info:
+                if chapter_ids and chaper.ch_id not in chapter_ids:
+                    continue
+                tasks.extend(self._get_tasks(chaper))
+
         return tasks
 
 
 class Download(object):
 
-    def __init__(self, tasks: List[TaskInfoItem]):
+    def __init__(self, tasks: List[TaskInfoItem], video_num: int = 3, max_connections: int = 32, resolve_num: int = 8, hls: bool = False, rate_limit: int = 0,
+                 metrics_log: str = None, metrics_port: int = 0, limiter: RateLimiter = None,
+                 on_done: Callable[[TaskInfoItem, int], None] = None, progress: Progress = None, remux: bool = False,
+                 resolutions: Dict[str, int] = None):
+        """
+            多视频流水线下载：解析后续视频地址的同时下载当前视频，解密与收尾工作交给线程池
+
+            Args:
+                tasks (List[TaskInfoItem]): 待下载的tasks
+                video_num (int, optional): 同时下载的视频数. Defaults to 3.
+                max_connections (int, optional): 所有视频共享的最大连接数. Defaults to 32.
+                resolve_num (int, optional): 同时解析地址的视频数. Defaults to 8.
+                hls (bool, optional): 按m3u8分片下载. Defaults to False.
+                rate_limit (int, optional): 所有视频共享的带宽上限（字节/秒），0 为不限制. Defaults to 0.
+                    下载中可通过 self.limiter 调整带宽与连接数
+                metrics_log (str, optional): 下载事件JSON-lines日志路径. Defaults to None.
+                metrics_port (int, optional): 在该端口提供Prometheus格式的 /metrics，0 为不提供. Defaults to 0.
+                limiter (RateLimiter, optional): 多个课程同时下载时共用的限速器，为空时按rate_limit/max_connections创建. Defaults to None.
+                on_done (Callable, optional): 每个视频下载完成后调用 on_done(task, total_size). Defaults to None.
+                progress (Progress, optional): 多个课程同时下载时共用的汇总进度，由调用方开始/停止显示. Defaults to None.
+                remux (bool, optional): 边下载边转为mp4（只复制流，不重新编码），输出 .mp4 而不是 .ts. Defaults to False.
+                resolutions (Dict[str, int], optional): 每个视频的清晰度 taid => transcodeList下标，见 planner.Planner，默认最后一个. Defaults to None.
+        """
         self.tasks = tasks
+        self.video_num = video_num
+        self.max_connections = max_connections
+        self.resolve_num = resolve_num
+        self.hls = hls
+        self.remux = remux
+        self.resolutions = resolutions or {}
+        self.limiter = limiter or RateLimiter(rate_limit, max_connections)
+        self.on_done = on_done
+        metrics.configure(metrics_log, metrics_port)
+
+        self.own_progress = progress is None
+        self.progress = progress or Progress()
+        self.progress.add_videos(len(tasks))
+
+        if remux:
+            for task in tasks:
+                task.download_path = task.download_path.with_suffix(".mp4")
+
+        # 获取地址或下载失败的task名
+        self.failed: List[str] = []
+
+    async def _resolve(self, queue: asyncio.Queue):
+        """
+            并发解析视频下载地址，按顺序放入队列，队列满时等待下载腾出位置
+        """
+        todo = []
+        for index, task in enumerate(self.tasks):
+            if task.download_path.exists():
+                self.progress.log(f"{task.name} Already exists.")
+                self.progress.finish_video(started=False)
+            else:
+                todo.append((index, task))
+
+        async with create_client(self.resolve_num) as client:
+            resolving = TaskUrls.resolve_all([task for _, task in todo], client, self.resolve_num, self.hls, self.resolutions)
+
+            for (index, task), future in zip(todo, resolving):
+                try:
+                    urls = await future
+                except Exception as e:
+                    self.failed.append(task.name)
+                    self.progress.finish_video(False, started=False)
+                    self.progress.log(f"获取下载地址失败 => [{task.name}]\n报错信息:{e}")
+                    continue
+
+                if urls:
+                    await queue.put((index, task, *urls))
+                else:
+                    # 未开放的视频不计入
+                    self.progress.add_videos(-1)
 
-    def main(self):
+        for _ in range(self.video_num):
+            await queue.put(None)
 
-        print(f"共:{len(self.tasks)} 个视频等待下载...")
+    def _refresher(self, task: TaskInfoItem):
+        """
+            生成task下载地址过期时的刷新函数
+        """
+        async def refresh():
+            async with create_client() as client:
+                url, _, _ = await TaskUrls(task, self.hls, self.resolutions.get(task.taid, -1)).refresh(client)
+            return url
 
-        for task in tasks:
-            print("*"*30)
-            if task.download_path.exists():
-                print(f"{task.name} Already exists.")
-                continue
+        return refresh
+
+    async def _download(self, queue: asyncio.Queue, pool: ThreadPoolExecutor, retry: RetryPolicy):
 
-            urls = TaskUrls(task)
-            if urls.is_valid:
-                print(f"正在下载({tasks.index(task) + 1}/{len(self.tasks)}): => [{task.name}]")
-                ts_url, key_url = urls.get()
-                download = AsyncDownloader(url=ts_url, key_url=key_url, file_path=task.download_path)
-                download.main()
+        from downloader import AsyncDownloader
+        from hls import HlsDownloader
+
+        loop = asyncio.get_running_loop()
+
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+
+            index, task, url, key, total_size = item
+            self.progress.log(f"正在下载({index + 1}/{len(self.tasks)}): => [{task.name}]")
+            self.progress.start_video()
+
+            try:
+                if self.hls:
+                    download = HlsDownloader(url=url, key=key, file_path=task.download_path, file_size=total_size, limiter=self.limiter,
+                                             executor=pool, retry=retry, refresh=self._refresher(task), progress=self.progress,
+                                             remux=self.remux)
+                else:
+                    download = await asyncio.to_thread(
+                        AsyncDownloader, url=url, key=key, file_size=total_size, file_path=task.download_path, limiter=self.limiter,
+                        executor=pool, retry=retry, refresh=self._refresher(task), progress=self.progress, remux=self.remux
+                    )
+                await download.main_download()
+                await loop.run_in_executor(pool, download._finish)
+                metrics.emit("task", video=task.name, status="ok")
+                self.progress.finish_video()
+                if self.on_done:
+                    self.on_done(task, total_size)
+            except Exception as e:
+                metrics.emit("task", video=task.name, status="failed", error=repr(e))
+                self.failed.append(task.name)
+                self.progress.finish_video(False)
+                self.progress.log(f"下载失败 => [{task.name}]\n报错信息:{e}")
+
+    async def main_download(self):
+
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.video_num)
+        retry = RetryPolicy()
+
+        if self.own_progress:
+            self.progress.start()
+
+        # pycryptodome解密时释放GIL，线程池即可利用多核
+        try:
+            with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+                await asyncio.gather(
+                    self._resolve(queue),
+                    *[self._download(queue, pool, retry) for _ in range(self.video_num)]
+                )
+        finally:
+            if self.own_progress:
+                self.progress.stop()
+
+    def main(self):
+
+        print(f"共:{len(self.tasks)} 个视频等待下载...")
+        asyncio.run(self.main_download())
 
 
 if __name__ == '__main__':
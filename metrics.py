@@ -0,0 +1,108 @@
+import json
+import time
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from contextlib import contextmanager
+from collections import defaultdict
+
+
+# 作为Prometheus标签的事件字段
+LABELS = ("step", "kind", "status", "mode")
+
+
+class Metrics(object):
+
+    def __init__(self):
+        """
+            下载过程的结构化事件，写入JSON-lines日志并汇总为Prometheus文本格式
+
+            事件：
+                resolve: TaskUrls每一步的耗时 step / file_id / duration
+                range: 每次Range请求 video / chunks / bytes / ttfb / duration / throughput
+                segment: 每个HLS分片 video / sequence / bytes / ttfb / duration
+                retry: 每次重试 video / kind / attempt / error
+                video: 每个视频下载完成 video / mode / bytes / duration / decrypt / retries
+                finish: 去除填充与重命名 video / duration
+                task: 批量下载中每个视频的结果 video / status
+        """
+        self.log_path: Optional[Path] = None
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Tuple], float] = defaultdict(float)
+        self._server = None
+
+    def configure(self, log_path: str = None, port: int = 0):
+        """
+            Args:
+                log_path (str): JSON-lines日志路径，为空不写日志
+                port (int): 在该端口提供 /metrics，0 为不提供
+        """
+        self.log_path = Path(log_path) if log_path else None
+        if port and self._server is None:
+            self.serve(port)
+
+    def emit(self, event: str, **fields):
+
+        fields = {"time": time.time(), "event": event, **fields}
+        labels = tuple((name, str(fields[name])) for name in LABELS if name in fields)
+
+        with self._lock:
+            self._counters[(f"{event}_total", labels)] += 1
+            if "bytes" in fields:
+                self._counters[(f"{event}_bytes_total", labels)] += fields["bytes"]
+            if "duration" in fields:
+                self._counters[(f"{event}_seconds_sum", labels)] += fields["duration"]
+                self._counters[(f"{event}_seconds_count", labels)] += 1
+
+            if self.log_path:
+                with open(self.log_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(fields, ensure_ascii=False, default=str) + "\n")
+
+    @contextmanager
+    def timer(self, event: str, **fields):
+        """
+            记录代码块耗时，出错时附带error字段
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            fields["error"] = repr(e)
+            raise
+        finally:
+            self.emit(event, duration=time.perf_counter() - start, **fields)
+
+    def render(self):
+        """
+            Prometheus 文本格式
+        """
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                label_text = ",".join(f'{key}="{value}"' for key, value in labels)
+                lines.append(f"tencent_course_{name}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int):
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+
+metrics = Metrics()
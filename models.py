@@ -1,13 +1,8 @@
 from pathlib import Path
-from typing import List, TypeVar
+from typing import List, Literal, Optional
 from pydantic import BaseModel
 
 
-# Choose cid
-class ChooseCidModel(BaseModel):
-    name: str
-    cid: int
-
 # ! get_token
 
 
@@ -63,6 +58,15 @@ class VideoInfoModel(BaseModel):
     videoInfo: VideoInfo
 
 
+# ! m3u8
+class HlsSegment(BaseModel):
+    url: str
+    sequence: int  # * EXT-X-MEDIA-SEQUENCE 起算的序号，未指定IV时作为IV
+    duration: float
+    key_uri: Optional[str] = None  # * 为空则未加密
+    iv: Optional[bytes] = None
+
+
 # ! Main Term Molder
 class TaskInfoItem(BaseModel):
     create_time: int
@@ -133,4 +137,24 @@ class CourseModel(BaseModel):
     retcode: int
 
 
-OPT = TypeVar('OPT', Term, ChapterInfoItem, SubInfoItem, TaskInfoItem, ChooseCidModel)
+# ! Batch manifest
+class ManifestCourse(BaseModel):
+    cid: int
+    terms: List[int] = []  # * 为空则下载全部term
+    chapters: List[int] = []  # * ch_id，为空则下载全部章节
+
+
+class ManifestModel(BaseModel):
+    courses: List[ManifestCourse]
+    root: str = "Data"
+    course_num: int = 2  # * 同时下载的课程数
+    video_num: int = 3
+    max_connections: int = 32
+    rate_limit: int = 0
+    hls: bool = False
+    remux: bool = False  # * 输出mp4
+    order: Literal["course", "shortest", "largest"] = "course"  # * 下载顺序，见 planner.ORDERS
+    disk_budget: int = 0  # * 每个课程的磁盘预算（字节），超出时降低清晰度
+    time_budget: int = 0  # * 每个课程的下载时间预算（秒），需要bandwidth
+    bandwidth: int = 0  # * 预计带宽（字节/秒），默认使用rate_limit
+
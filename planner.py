@@ -0,0 +1,248 @@
+from __future__ import annotations
+
+import heapq
+import asyncio
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from main import TaskUrls, create_client
+from progress import format_size, format_time
+
+if TYPE_CHECKING:
+    import httpx
+    from models import TaskInfoItem, TranscodeListItem
+
+
+# 下载队列的排序：课程顺序 / 小文件优先（平均完成时间最短） / 大文件优先（多个视频同时下载时整批最早完成）
+ORDERS = ("course", "shortest", "largest")
+
+
+class PlanItem(object):
+
+    __slots__ = ("task", "transcodes", "candidates", "level")
+
+    def __init__(self, task: TaskInfoItem, transcodes: List[TranscodeListItem]):
+        """
+            一个视频可选的清晰度
+
+            candidates 为可选的transcodeList下标，从默认的最后一个开始，按文件大小从大到小排列
+            level 为当前选择的下标在candidates中的位置，0 为默认清晰度
+
+            Args:
+                task (TaskInfoItem):
+                transcodes (List[TranscodeListItem]): getplayinfo中的transcodeList
+        """
+        self.task = task
+        self.transcodes = transcodes
+
+        default = len(transcodes) - 1
+        smaller = [index for index in range(default) if transcodes[index].totalSize < transcodes[default].totalSize]
+        self.candidates = [default] + sorted(smaller, key=lambda index: transcodes[index].totalSize, reverse=True)
+        self.level = 0
+
+    def transcode(self, level: int = None):
+        """
+            Args:
+                level (int, optional): 清晰度档位，超出可选范围时取最低一档，默认为当前选择. Defaults to None.
+        """
+        level = self.level if level is None else min(level, len(self.candidates) - 1)
+        return self.transcodes[self.candidates[level]]
+
+    @property
+    def choice(self):
+        return self.candidates[self.level]
+
+    @property
+    def size(self):
+        return self.transcode().totalSize
+
+    @property
+    def bitrate(self):
+        transcode = self.transcode()
+        return transcode.totalSize / transcode.duration if transcode.duration else transcode.totalSize
+
+
+class Planner(object):
+
+    def __init__(self, tasks: List[TaskInfoItem], hls: bool = False, bandwidth: int = 0, resolve_num: int = 8):
+        """
+            下载前的规划：预先获取所有视频的transcodeList，统计每档清晰度的总大小与预计耗时，
+            按磁盘或时间预算为每个视频选择清晰度，并调整下载顺序
+
+            Args:
+                tasks (List[TaskInfoItem]): 待下载的tasks
+                hls (bool, optional): 见TaskUrls. Defaults to False.
+                bandwidth (int, optional): 预计带宽（字节/秒），用于估算耗时，0 为未知. Defaults to 0.
+                resolve_num (int, optional): 同时获取的视频数. Defaults to 8.
+        """
+        self.tasks = tasks
+        self.hls = hls
+        self.bandwidth = bandwidth
+        self.resolve_num = resolve_num
+
+        # 需要下载的视频
+        self.items: List[PlanItem] = []
+        # 不需要规划的视频：taid => 已存在 / 未开放 / 获取失败(...)
+        self.status: Dict[str, str] = {}
+        self.failed: List[str] = []
+
+    async def fetch(self, client: httpx.AsyncClient = None, redownload: List[TaskInfoItem] = ()):
+        """
+            获取所有视频的清晰度列表（getplayinfo有缓存，之后解析下载地址时不再请求）
+
+            Args:
+                client (httpx.AsyncClient, optional): 共用的连接池client，为空时创建. Defaults to None.
+                redownload (List[TaskInfoItem], optional): 本地已存在但需要重新下载的视频（同步时改变的视频）. Defaults to ().
+        """
+        if client is None:
+            async with create_client(self.resolve_num) as client:
+                return await self.fetch(client, redownload)
+
+        semaphore = asyncio.Semaphore(self.resolve_num)
+        redownload = {task.taid for task in redownload}
+
+        async def _fetch(task: TaskInfoItem):
+            if task.download_path.exists() and task.taid not in redownload:
+                self.status[task.taid] = "已存在"
+                return None
+            urls = TaskUrls(task, self.hls)
+            if not urls.is_valid:
+                self.status[task.taid] = "未开放"
+                return None
+            async with semaphore:
+                try:
+                    return PlanItem(task, await urls.transcodes(client))
+                except Exception as e:
+                    self.failed.append(task.name)
+                    self.status[task.taid] = f"获取失败({e})"
+                    return None
+
+        items = await asyncio.gather(*[_fetch(task) for task in self.tasks])
+        self.items = [item for item in items if item is not None and item.transcodes]
+
+    @property
+    def total_size(self):
+        return sum(item.size for item in self.items)
+
+    def estimate(self, size: int):
+        """
+            按带宽估算下载耗时
+
+            Returns:
+                str: 时:分:秒，带宽未知时为 --:--
+        """
+        return format_time(size / self.bandwidth) if self.bandwidth else "--:--"
+
+    def summary(self):
+        """
+            每档清晰度下全部视频的总大小、总时长与预计下载耗时，0 为默认清晰度（transcodeList最后一个）
+            某些视频可选的清晰度较少时按其最低一档计算
+
+            Returns:
+                List[dict]: level / size / duration / estimate
+        """
+        levels = max((len(item.candidates) for item in self.items), default=0)
+
+        summary = []
+        for level in range(levels):
+            transcodes = [item.transcode(level) for item in self.items]
+            size = sum(transcode.totalSize for transcode in transcodes)
+            summary.append({
+                "level": level,
+                "size": size,
+                "duration": sum(transcode.duration for transcode in transcodes),
+                "estimate": self.estimate(size),
+            })
+
+        return summary
+
+    def choose(self, disk_budget: int = 0, time_budget: int = 0):
+        """
+            为每个视频选择清晰度：默认使用最后一个，超出预算时码率最高（相同时文件最大）的视频先降一档，直到符合预算
+
+            Args:
+                disk_budget (int, optional): 磁盘预算（字节），0 为不限制. Defaults to 0.
+                time_budget (int, optional): 下载时间预算（秒），需要指定带宽，0 为不限制. Defaults to 0.
+
+            Raises:
+                ValueError: 指定了时间预算但带宽未知
+
+            Returns:
+                bool: 是否符合预算，全部降到最低一档仍超出时为False
+        """
+        if time_budget and not self.bandwidth:
+            raise ValueError("按时间预算规划需要指定带宽")
+
+        budgets = [budget for budget in (disk_budget, time_budget * self.bandwidth) if budget]
+
+        for item in self.items:
+            item.level = 0
+
+        if not budgets:
+            return True
+
+        budget = min(budgets)
+        total = self.total_size
+
+        heap = [(-item.bitrate, -item.size, index) for index, item in enumerate(self.items) if len(item.candidates) > 1]
+        heapq.heapify(heap)
+
+        while total > budget and heap:
+            *_, index = heapq.heappop(heap)
+            item = self.items[index]
+
+            total -= item.size
+            item.level += 1
+            total += item.size
+
+            if item.level + 1 < len(item.candidates):
+                heapq.heappush(heap, (-item.bitrate, -item.size, index))
+
+        return total <= budget
+
+    def resolutions(self):
+        """
+            Returns:
+                Dict[str, int]: taid => transcodeList下标，传给Download
+        """
+        return {item.task.taid: item.choice for item in self.items}
+
+    def order(self, order: str = "course"):
+        """
+            按选择的清晰度排序下载队列，未规划的视频（已存在、获取失败）放在最后，由Download处理
+
+            Args:
+                order (str, optional): 见ORDERS. Defaults to "course".
+
+            Returns:
+                tasks:list[TaskInfoItem]
+        """
+        if order not in ORDERS:
+            raise ValueError(f"未知的排序方式: {order}，可选 {', '.join(ORDERS)}")
+
+        items = list(self.items)
+        if order != "course":
+            items.sort(key=lambda item: item.size, reverse=order == "largest")
+
+        planned = {item.task.taid for item in items}
+        return [item.task for item in items] + [task for task in self.tasks if task.taid not in planned]
+
+    def report(self, title: Optional[str] = None):
+        """
+            输出每档清晰度的统计与每个视频选择的清晰度和大小
+        """
+        print("*"*30)
+        if title:
+            print(title)
+
+        for line in self.summary():
+            print(f"  清晰度{line['level']}: {format_size(line['size'])}  时长 {format_time(line['duration'])}  预计耗时 {line['estimate']}")
+
+        items = {item.task.taid: item for item in self.items}
+        for task in self.tasks:
+            item = items.get(task.taid)
+            if item is None:
+                print(f"  {task.download_path}  {self.status.get(task.taid, '')}")
+            else:
+                print(f"  {task.download_path}  清晰度{item.level}  {format_size(item.size)}")
+
+        print(f"待下载:{len(self.items)} 个视频，共 {format_size(self.total_size)}，预计耗时 {self.estimate(self.total_size)}")
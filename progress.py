@@ -0,0 +1,172 @@
+import sys
+import time
+import threading
+from typing import Optional, TextIO
+
+
+# 终端中的刷新间隔（秒）
+RENDER_INTERVAL = 0.5
+# 输出不是终端时（重定向到日志文件、定时任务）每隔多久输出一行
+LOG_INTERVAL = 10
+# 吞吐量的平滑系数
+RATE_SMOOTHING = 0.3
+
+
+def format_size(size: float):
+
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(size) < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}TB"
+
+
+def format_time(seconds: float):
+
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
+
+
+class Progress(object):
+
+    def __init__(self, videos: int = 0, stream: TextIO = None, interval: float = None):
+        """
+            整批下载的汇总进度，多个视频、多个课程共用一个实例
+
+            下载协程只累加计数，由后台线程按固定间隔输出：
+            终端中原地刷新一行，否则每隔 LOG_INTERVAL 秒输出一行日志
+
+            Args:
+                videos (int, optional): 等待下载的视频数，之后可通过 add_videos 增加. Defaults to 0.
+                stream (TextIO, optional): 输出位置. Defaults to sys.stdout.
+                interval (float, optional): 输出间隔（秒），默认按是否为终端选择. Defaults to None.
+        """
+        self.stream = stream or sys.stdout
+        self.tty = self.stream.isatty()
+        self.interval = interval or (RENDER_INTERVAL if self.tty else LOG_INTERVAL)
+
+        # 字节，done只由事件循环线程累加；视频可能在其他线程中初始化，total/resumed加锁
+        self.total = 0
+        self.done = 0
+        self.resumed = 0
+        self._lock = threading.Lock()
+
+        # 视频数
+        self.videos = videos
+        self.active = 0
+        self.finished = 0
+        self.failed = 0
+
+        self.rate = 0.0
+        self._started = time.monotonic()
+        self._last = (0, self._started)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def queued(self):
+        return max(self.videos - self.active - self.finished - self.failed, 0)
+
+    def add_videos(self, count: int):
+        self.videos += count
+
+    def add_total(self, size: int, done: int = 0):
+        """
+            视频大小确定后计入总量
+
+            Args:
+                size (int): 视频大小（字节）
+                done (int, optional): 断点续传已完成的大小，不计入吞吐量. Defaults to 0.
+        """
+        with self._lock:
+            self.total += size
+            self.resumed += done
+
+    def update(self, size: int):
+        # 每次收到数据都会调用，只做加法；失败重下时传入负数回退
+        self.done += size
+
+    def start_video(self):
+        self.active += 1
+
+    def finish_video(self, ok: bool = True, started: bool = True):
+        """
+            视频结束，ok为False时计入失败
+
+            Args:
+                ok (bool, optional): 是否成功. Defaults to True.
+                started (bool, optional): 是否调用过start_video，已存在、获取地址失败的视频为False. Defaults to True.
+        """
+        if started:
+            self.active -= 1
+        if ok:
+            self.finished += 1
+        else:
+            self.failed += 1
+
+    def log(self, message: str):
+        """
+            输出一行消息，终端中先清除进度行，之后由下一次刷新重新显示
+        """
+        self.stream.write(("\r\033[K" if self.tty and self._thread else "") + message + "\n")
+        self.stream.flush()
+
+    def render(self, final: bool = False):
+        """
+            Args:
+                final (bool, optional): 最终进度，显示整个过程的平均速度. Defaults to False.
+        """
+        # 吞吐量只按本次下载的字节计算
+        now = time.monotonic()
+        last_done, last_time = self._last
+        if final:
+            self.rate = self.done / (now - self._started) if now > self._started else 0.0
+        elif now > last_time:
+            rate = max(self.done - last_done, 0) / (now - last_time)
+            self.rate = rate if not self.rate else self.rate + RATE_SMOOTHING * (rate - self.rate)
+        self._last = (self.done, now)
+
+        done = self.done + self.resumed
+
+        percent = done / self.total * 100 if self.total else 0.0
+        eta = format_time((self.total - done) / self.rate) if self.rate and self.total > done else "--:--"
+
+        return (f"{percent:5.1f}% {format_size(done)}/{format_size(self.total)} {format_size(self.rate)}/s ETA {eta}"
+                f" | 下载中:{self.active} 等待:{self.queued} 完成:{self.finished} 失败:{self.failed}")
+
+    def _output(self, final: bool = False):
+
+        line = self.render(final)
+        if self.tty:
+            self.stream.write("\r" + line + "\033[K" + ("\n" if final else ""))
+        else:
+            self.stream.write(time.strftime("%H:%M:%S ") + line + "\n")
+        self.stream.flush()
+
+    def _run(self):
+
+        while not self._stop.wait(self.interval):
+            self._output()
+
+    def start(self):
+
+        if self._thread is None:
+            self._started = time.monotonic()
+            self._last = (self.done, self._started)
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="progress", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+            停止刷新并输出最终进度
+        """
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._output(final=True)
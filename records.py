@@ -0,0 +1,125 @@
+"""
+    不依赖pydantic的轻量数据类，导入本模块不会加载pydantic
+"""
+from pathlib import Path
+from typing import List, Tuple, TypeVar
+
+
+# Choose cid
+class ChooseCidModel(object):
+    # 课程表可能很长，只用于菜单显示，不需要校验
+    __slots__ = ("name", "cid")
+
+    def __init__(self, name: str, cid: int):
+        self.name = name
+        self.cid = cid
+
+
+# ! Lightweight course tree
+class Record(object):
+    """
+        basic_info 课程树的轻量记录，代替整棵树的pydantic校验
+
+        只保留用到的字段且不做校验，子节点在首次访问时才创建，
+        选中的task再通过 TaskRecord.model() 校验为 TaskInfoItem
+    """
+    __slots__ = ("index", "_raw", "_children")
+
+    FIELDS: Tuple[str, ...] = ()
+    CHILDREN = ""  # * 子节点字段名
+    CHILD = None  # * 子节点类型
+
+    def __init__(self, data: dict, index: int = 0):
+        for name in self.FIELDS:
+            setattr(self, name, data.get(name))
+
+        self.index = index  # * 在父级中的序号
+        self._raw = data.get(self.CHILDREN) or () if self.CHILDREN else ()
+        self._children = None
+
+    @property
+    def children(self):
+        if self._children is None:
+            self._children = [self.CHILD(item, index) for index, item in enumerate(self._raw)]
+            self._raw = ()
+        return self._children
+
+    def taids(self):
+        """
+            子树中所有task的taid，未展开的部分直接读取原始数据，不创建记录
+        """
+        if self._children is not None:
+            for child in self._children:
+                yield from child.taids()
+        else:
+            yield from self.CHILD._raw_taids(self._raw)
+
+    @classmethod
+    def _raw_taids(cls, items):
+        for item in items:
+            yield from cls.CHILD._raw_taids(item.get(cls.CHILDREN) or ())
+
+
+class TaskRecord(Record):
+    FIELDS = ("taid", "name", "cid", "term_id", "resid_list", "resid_ext")
+    __slots__ = FIELDS + ("download_path", "_data")
+
+    def __init__(self, data: dict, index: int = 0):
+        super().__init__(data, index)
+        self.download_path = Path("NotFound")
+        self._data = data
+
+    def taids(self):
+        yield self.taid
+
+    @classmethod
+    def _raw_taids(cls, items):
+        for item in items:
+            yield item.get("taid")
+
+    def model(self):
+        """
+            校验为 TaskInfoItem
+        """
+        from models import TaskInfoItem
+
+        return TaskInfoItem(**{**self._data, "download_path": self.download_path})
+
+
+class SubRecord(Record):
+    FIELDS = ("sub_id", "name", "term_id", "cid")
+    __slots__ = FIELDS
+    CHILDREN = "task_info"
+    CHILD = TaskRecord
+
+    task_info: List[TaskRecord] = Record.children
+
+
+class ChapterRecord(Record):
+    FIELDS = ("ch_id", "name", "term_id", "cid")
+    __slots__ = FIELDS
+    CHILDREN = "sub_info"
+    CHILD = SubRecord
+
+    sub_info: List[SubRecord] = Record.children
+
+
+class TermRecord(Record):
+    FIELDS = ("term_id", "name", "cid")
+    __slots__ = FIELDS
+    CHILDREN = "chapter_info"
+    CHILD = ChapterRecord
+
+    chapter_info: List[ChapterRecord] = Record.children
+
+
+class CourseRecord(Record):
+    FIELDS = ("name", "cid")
+    __slots__ = FIELDS
+    CHILDREN = "terms"
+    CHILD = TermRecord
+
+    terms: List[TermRecord] = Record.children
+
+
+OPT = TypeVar('OPT', TermRecord, ChapterRecord, SubRecord, TaskRecord, ChooseCidModel)
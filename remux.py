@@ -0,0 +1,634 @@
+import re
+import base64
+import struct
+from typing import Dict, List, Optional
+
+
+# MPEG-TS
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+# PMT中的stream_type，只支持H.264与AAC(ADTS)，其他流忽略
+STREAM_H264 = 0x1B
+STREAM_AAC = 0x0F
+# PES中的时间戳为90kHz，33位
+TS_CLOCK = 90000
+PTS_WRAP = 1 << 33
+
+# 只有音频时每多少帧输出一个fragment
+AUDIO_FRAGMENT_FRAMES = 100
+# 每个AAC帧的采样数
+AAC_FRAME_SAMPLES = 1024
+AAC_SAMPLE_RATES = (96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050, 16000, 12000, 11025, 8000, 7350)
+
+# trun中的sample_flags
+SYNC_SAMPLE_FLAGS = 0x02000000
+NON_SYNC_SAMPLE_FLAGS = 0x01010000
+
+
+class RemuxError(Exception):
+    """
+        TS流中没有可转换的H.264/AAC流
+    """
+
+
+def box(kind: bytes, *payloads: bytes):
+    payload = b"".join(payloads)
+    return struct.pack(">I4s", 8 + len(payload), kind) + payload
+
+
+def full_box(kind: bytes, version: int, flags: int, *payloads: bytes):
+    return box(kind, struct.pack(">I", version << 24 | flags), *payloads)
+
+
+class BitReader(object):
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+
+    def bits(self, count: int):
+        value = 0
+        for _ in range(count):
+            value = value << 1 | (self.data[self.pos >> 3] >> (7 - (self.pos & 7))) & 1
+            self.pos += 1
+        return value
+
+    def ue(self):
+        zeros = 0
+        while self.bits(1) == 0:
+            zeros += 1
+        return (1 << zeros) - 1 + self.bits(zeros)
+
+    def se(self):
+        value = self.ue()
+        return (value + 1) // 2 if value & 1 else -(value // 2)
+
+
+def parse_sps(sps: bytes):
+    """
+        从H.264 SPS中解析分辨率与avcC需要的字段
+
+        Args:
+            sps (bytes): SPS NAL（含NAL头）
+
+        Returns:
+            dict: profile / compatibility / level / chroma_format / bit_depth_luma / bit_depth_chroma / width / height
+    """
+    # 去除防竞争字节 00 00 03
+    reader = BitReader(re.sub(b"\x00\x00\x03", b"\x00\x00", sps[1:]))
+
+    profile = reader.bits(8)
+    compatibility = reader.bits(8)
+    level = reader.bits(8)
+    reader.ue()  # seq_parameter_set_id
+
+    chroma_format, bit_depth_luma, bit_depth_chroma = 1, 8, 8
+    if profile in (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135):
+        chroma_format = reader.ue()
+        if chroma_format == 3:
+            reader.bits(1)  # separate_colour_plane_flag
+        bit_depth_luma = reader.ue() + 8
+        bit_depth_chroma = reader.ue() + 8
+        reader.bits(1)  # qpprime_y_zero_transform_bypass_flag
+        if reader.bits(1):  # seq_scaling_matrix_present_flag
+            for index in range(8 if chroma_format != 3 else 12):
+                if reader.bits(1):
+                    last, following = 8, 8
+                    for _ in range(16 if index < 6 else 64):
+                        if following:
+                            following = (last + reader.se() + 256) % 256
+                        last = following or last
+
+    reader.ue()  # log2_max_frame_num_minus4
+    poc_type = reader.ue()
+    if poc_type == 0:
+        reader.ue()
+    elif poc_type == 1:
+        reader.bits(1)
+        reader.se()
+        reader.se()
+        for _ in range(reader.ue()):
+            reader.se()
+
+    reader.ue()  # max_num_ref_frames
+    reader.bits(1)  # gaps_in_frame_num_value_allowed_flag
+    width_mbs = reader.ue() + 1
+    height_map_units = reader.ue() + 1
+    frame_mbs_only = reader.bits(1)
+    if not frame_mbs_only:
+        reader.bits(1)  # mb_adaptive_frame_field_flag
+    reader.bits(1)  # direct_8x8_inference_flag
+
+    width = width_mbs * 16
+    height = (2 - frame_mbs_only) * height_map_units * 16
+
+    if reader.bits(1):  # frame_cropping_flag
+        left, right, top, bottom = reader.ue(), reader.ue(), reader.ue(), reader.ue()
+        if chroma_format == 0:
+            crop_x, crop_y = 1, 2 - frame_mbs_only
+        else:
+            crop_x = 2 if chroma_format in (1, 2) else 1
+            crop_y = (2 if chroma_format == 1 else 1) * (2 - frame_mbs_only)
+        width -= (left + right) * crop_x
+        height -= (top + bottom) * crop_y
+
+    return {"profile": profile, "compatibility": compatibility, "level": level, "chroma_format": chroma_format,
+            "bit_depth_luma": bit_depth_luma, "bit_depth_chroma": bit_depth_chroma, "width": width, "height": height}
+
+
+def split_nals(data: bytes):
+    """
+        按起始码 00 00 01 / 00 00 00 01 切分Annex B字节流
+    """
+    nals = []
+    start = data.find(b"\x00\x00\x01")
+
+    while start != -1:
+        start += 3
+        end = data.find(b"\x00\x00\x01", start)
+        nal = data[start:] if end == -1 else data[start:end]
+        # 四字节起始码与末尾的填充零
+        nal = nal.rstrip(b"\x00")
+        if nal:
+            nals.append(nal)
+        start = end
+
+    return nals
+
+
+class Track(object):
+
+    def __init__(self, kind: str, timescale: int = TS_CLOCK):
+        """
+            输出的一条MP4 track
+
+            Args:
+                kind (str): video / audio
+                timescale (int): 时间单位，视频为90kHz，音频为采样率
+        """
+        self.kind = kind
+        self.timescale = timescale
+        self.track_id = 0
+
+        # 编码参数：视频为SPS/PPS，音频为ADTS头中的 object_type / sample_rate_index / channels
+        self.sps: Optional[bytes] = None
+        self.pps: Optional[bytes] = None
+        self.audio_config: Optional[tuple] = None
+
+        # 等待输出的sample: [dts(90kHz), cts偏移(90kHz), 是否关键帧, 数据]
+        self.samples: List[list] = []
+        # 上一个已输出sample的时长，最后一个sample时长未知时沿用
+        self.duration = 0
+        # 时间戳回绕的累计偏移
+        self.wrap = 0
+        self.last_dts: Optional[int] = None
+
+    @property
+    def ready(self):
+        return (self.sps is not None and self.pps is not None) if self.kind == "video" else self.audio_config is not None
+
+    def unwrap(self, timestamp: int):
+        """
+            33位时间戳约26.5小时回绕一次
+        """
+        timestamp += self.wrap
+        if self.last_dts is not None and timestamp < self.last_dts - PTS_WRAP // 2:
+            self.wrap += PTS_WRAP
+            timestamp += PTS_WRAP
+        return timestamp
+
+    def sample_entry(self):
+
+        if self.kind == "video":
+            sps = parse_sps(self.sps)
+            avcc = struct.pack(">BBBBBB", 1, sps["profile"], sps["compatibility"], sps["level"], 0xFF, 0xE1)
+            avcc += struct.pack(">H", len(self.sps)) + self.sps + struct.pack(">BH", 1, len(self.pps)) + self.pps
+            if sps["profile"] in (100, 110, 122, 144):
+                avcc += struct.pack(">BBBB", 0xFC | sps["chroma_format"], 0xF8 | sps["bit_depth_luma"] - 8,
+                                    0xF8 | sps["bit_depth_chroma"] - 8, 0)
+
+            return box(
+                b"avc1", bytes(6), struct.pack(">H", 1), bytes(16), struct.pack(">HHIIIH", sps["width"], sps["height"], 0x00480000, 0x00480000, 0, 1),
+                bytes(32), struct.pack(">Hh", 0x0018, -1), box(b"avcC", avcc)
+            ), sps["width"], sps["height"]
+
+        object_type, rate_index, channels = self.audio_config
+        config = struct.pack(">H", object_type << 11 | rate_index << 7 | channels << 3)
+
+        def descriptor(tag: int, payload: bytes):
+            return struct.pack(">BB", tag, len(payload)) + payload
+
+        esds = descriptor(3, struct.pack(">HB", self.track_id, 0) + descriptor(
+            4, struct.pack(">BB", 0x40, 0x15) + bytes(3) + struct.pack(">II", 0, 0) + descriptor(5, config)
+        ) + descriptor(6, b"\x02"))
+
+        return box(
+            b"mp4a", bytes(6), struct.pack(">H", 1), bytes(8), struct.pack(">HHHH", channels, 16, 0, 0), struct.pack(">I", min(self.timescale, 0xFFFF) << 16),
+            full_box(b"esds", 0, 0, esds)
+        ), 0, 0
+
+    def trak(self):
+
+        entry, width, height = self.sample_entry()
+        matrix = struct.pack(">9I", 0x00010000, 0, 0, 0, 0x00010000, 0, 0, 0, 0x40000000)
+        video = self.kind == "video"
+
+        tkhd = full_box(b"tkhd", 0, 3, struct.pack(">IIIII", 0, 0, self.track_id, 0, 0), bytes(8),
+                        struct.pack(">hhhH", 0, 0, 0 if video else 0x0100, 0), matrix, struct.pack(">II", width << 16, height << 16))
+        mdhd = full_box(b"mdhd", 0, 0, struct.pack(">IIIIHH", 0, 0, self.timescale, 0, 0x55C4, 0))
+        hdlr = full_box(b"hdlr", 0, 0, struct.pack(">I4s", 0, b"vide" if video else b"soun"), bytes(12),
+                        b"VideoHandler\x00" if video else b"SoundHandler\x00")
+        media_header = full_box(b"vmhd", 0, 1, bytes(8)) if video else full_box(b"smhd", 0, 0, bytes(4))
+        dinf = box(b"dinf", full_box(b"dref", 0, 0, struct.pack(">I", 1), full_box(b"url ", 0, 1)))
+        stbl = box(
+            b"stbl", full_box(b"stsd", 0, 0, struct.pack(">I", 1), entry), full_box(b"stts", 0, 0, bytes(4)),
+            full_box(b"stsc", 0, 0, bytes(4)), full_box(b"stsz", 0, 0, bytes(8)), full_box(b"stco", 0, 0, bytes(4))
+        )
+
+        return box(b"trak", tkhd, box(b"mdia", mdhd, hdlr, box(b"minf", media_header, dinf, stbl)))
+
+    def convert(self, timestamp: float):
+        # 90kHz => 本track的时间单位
+        return round(timestamp * self.timescale / TS_CLOCK)
+
+
+class TsRemuxer(object):
+
+    def __init__(self, state: dict = None):
+        """
+            边接收边把解密后的MPEG-TS流转为fragmented MP4（只复制流，不重新编码）
+
+            feed() 按顺序传入TS数据，返回可以按顺序写入输出文件的MP4数据：
+            首个关键帧凑齐编码参数后输出 ftyp+moov，之后每个GOP输出一个 moof+mdat
+            输出只追加，不需要回头修改文件头，因此不需要先落盘完整的TS
+
+            Args:
+                state (dict, optional): 上次 flush() 后 state() 的返回值，用于断点续传
+                    （已输出的文件头不再重复输出，未接收完的PES与TS包从断点继续）. Defaults to None.
+        """
+        self._buffer = b""
+
+        # PID => stream_type / 未完成的PES
+        self._pmt_pid: Optional[int] = None
+        self._streams: Dict[int, int] = {}
+        self._pes: Dict[int, bytearray] = {}
+
+        self.tracks = {"video": Track("video"), "audio": Track("audio")}
+        # 已写入moov的track
+        self.output: List[Track] = []
+        self.origin: Optional[int] = None
+        self.sequence = 0
+
+        if state:
+            self.origin = state["origin"]
+            self.sequence = state["sequence"]
+            self._pmt_pid = state["pmt_pid"]
+            self._streams = {int(pid): stream_type for pid, stream_type in state["streams"].items()}
+            self._pes = {int(pid): bytearray(base64.b64decode(pes)) for pid, pes in state["pes"].items()}
+            self._buffer = base64.b64decode(state["buffer"])
+            for kind, values in state["tracks"].items():
+                track = self.tracks[kind]
+                track.track_id, track.timescale, track.duration, track.wrap, track.last_dts = values
+                self.output.append(track)
+
+    def state(self):
+        """
+            flush() 之后调用，返回可JSON序列化的状态，包括未接收完的PES与不完整的TS包
+        """
+        return {
+            "origin": self.origin,
+            "sequence": self.sequence,
+            "pmt_pid": self._pmt_pid,
+            "streams": self._streams,
+            "pes": {pid: base64.b64encode(pes).decode() for pid, pes in self._pes.items()},
+            "buffer": base64.b64encode(self._buffer).decode(),
+            "tracks": {track.kind: [track.track_id, track.timescale, track.duration, track.wrap, track.last_dts] for track in self.output},
+        }
+
+    def feed(self, data: bytes):
+        """
+            Args:
+                data (bytes): 按顺序传入的TS数据，可在任意位置切分
+
+            Returns:
+                bytes: 可以追加到输出文件的MP4数据
+        """
+        data = self._buffer + data
+        output = []
+
+        pos = 0
+        end = len(data) - TS_PACKET_SIZE
+        while pos <= end:
+            if data[pos] != TS_SYNC_BYTE:
+                # 丢失同步时找下一个同步字节
+                pos = data.find(TS_SYNC_BYTE, pos + 1)
+                if pos == -1:
+                    pos = len(data)
+                continue
+
+            output.append(self._packet(data[pos:pos + TS_PACKET_SIZE]))
+            pos += TS_PACKET_SIZE
+
+        self._buffer = data[pos:]
+        return b"".join(output)
+
+    def flush(self):
+        """
+            输出全部已接收完的sample，在HLS分片结束时调用，之后的 state() 可以保存下来断点续传
+            未接收完的PES与TS包保留到下次 feed()，分片边界处的sample不会丢失
+            最后一个视频sample的时长沿用上一个sample
+
+            Returns:
+                bytes: 可以追加到输出文件的MP4数据
+        """
+        return self._fragment()
+
+    def close(self):
+        """
+            流结束时调用，结束当前的PES并输出全部等待中的sample
+
+            Raises:
+                RemuxError: 没有可转换的H.264/AAC流
+        """
+        output = []
+
+        for pid in list(self._pes):
+            output.append(self._finish_pes(pid))
+        self._buffer = b""
+
+        output.append(self._fragment())
+        if not self.output:
+            raise RemuxError("未找到可转换为MP4的H.264/AAC流")
+        return b"".join(output)
+
+    def _packet(self, packet: bytes):
+
+        pid = (packet[1] & 0x1F) << 8 | packet[2]
+        start = packet[1] & 0x40
+        control = packet[3] >> 4 & 0x03
+
+        if not control & 0x01:
+            return b""
+
+        offset = 4
+        if control & 0x02:
+            offset += 1 + packet[4]
+        if offset >= TS_PACKET_SIZE:
+            return b""
+
+        payload = packet[offset:]
+
+        if pid == 0 and start:
+            self._parse_pat(payload)
+        elif pid == self._pmt_pid and start:
+            self._parse_pmt(payload)
+        elif pid in self._streams:
+            output = b""
+            if start:
+                output = self._finish_pes(pid)
+                self._pes[pid] = bytearray(payload)
+            elif pid in self._pes:
+                self._pes[pid] += payload
+            return output
+
+        return b""
+
+    @staticmethod
+    def _section(payload: bytes):
+        # pointer_field之后为PSI section，返回section_length范围内、CRC之前的内容
+        section = payload[1 + payload[0]:]
+        length = (section[1] & 0x0F) << 8 | section[2]
+        return section[:3 + length - 4]
+
+    def _parse_pat(self, payload: bytes):
+
+        section = self._section(payload)
+        for pos in range(8, len(section) - 3, 4):
+            program = section[pos] << 8 | section[pos + 1]
+            if program:
+                self._pmt_pid = (section[pos + 2] & 0x1F) << 8 | section[pos + 3]
+                return
+
+    def _parse_pmt(self, payload: bytes):
+
+        section = self._section(payload)
+        pos = 12 + ((section[10] & 0x0F) << 8 | section[11])
+
+        streams = {}
+        while pos + 5 <= len(section):
+            stream_type = section[pos]
+            pid = (section[pos + 1] & 0x1F) << 8 | section[pos + 2]
+            if stream_type in (STREAM_H264, STREAM_AAC):
+                streams[pid] = stream_type
+            pos += 5 + ((section[pos + 3] & 0x0F) << 8 | section[pos + 4])
+
+        self._streams = streams
+
+    @staticmethod
+    def _timestamp(data: bytes):
+        return ((data[0] >> 1) & 0x07) << 30 | data[1] << 22 | (data[2] >> 1) << 15 | data[3] << 7 | data[4] >> 1
+
+    def _finish_pes(self, pid: int):
+        """
+            一个PES接收完成（下一个PES开始或流结束）
+        """
+        pes = self._pes.pop(pid, None)
+        if not pes or pes[:3] != b"\x00\x00\x01" or len(pes) < 9:
+            return b""
+
+        flags = pes[7] >> 6
+        payload = bytes(pes[9 + pes[8]:])
+        if not flags & 0x02:
+            return b""
+
+        pts = self._timestamp(pes[9:14])
+        dts = self._timestamp(pes[14:19]) if flags == 0x03 else pts
+
+        if self._streams.get(pid) == STREAM_H264:
+            return self._video(payload, pts, dts)
+        return self._audio(payload, pts)
+
+    def _video(self, payload: bytes, pts: int, dts: int):
+
+        track = self.tracks["video"]
+        nals = []
+        key = False
+
+        for nal in split_nals(payload):
+            nal_type = nal[0] & 0x1F
+            if nal_type == 9:  # access unit delimiter
+                continue
+            if nal_type == 7 and track.sps is None:
+                track.sps = nal
+            elif nal_type == 8 and track.pps is None:
+                track.pps = nal
+            elif nal_type == 5:
+                key = True
+            nals.append(struct.pack(">I", len(nal)) + nal)
+
+        if not nals:
+            return b""
+
+        dts = track.unwrap(dts)
+        pts = dts + (pts - dts) % PTS_WRAP
+        track.last_dts = dts
+
+        output = b""
+        # 每个GOP输出一个fragment，此时之前所有视频sample的时长都已确定
+        if key and track.samples:
+            output = self._fragment(until=dts)
+
+        # moov写入前丢弃首个关键帧之前无法解码的帧
+        if key or track.samples or track in self.output:
+            track.samples.append([dts, pts - dts, key, b"".join(nals)])
+
+        return output
+
+    def _audio(self, payload: bytes, pts: int):
+
+        track = self.tracks["audio"]
+        pts = track.unwrap(pts)
+        track.last_dts = pts
+
+        output = b""
+        pos = 0
+        while pos + 7 <= len(payload):
+            header = payload[pos:pos + 7]
+            if header[0] != 0xFF or header[1] & 0xF0 != 0xF0:
+                break
+
+            header_size = 7 if header[1] & 0x01 else 9
+            frame_size = (header[3] & 0x03) << 11 | header[4] << 3 | header[5] >> 5
+            if frame_size <= header_size or pos + frame_size > len(payload):
+                break
+
+            if track.audio_config is None:
+                object_type = (header[2] >> 6) + 1
+                rate_index = header[2] >> 2 & 0x0F
+                channels = (header[2] & 0x01) << 2 | header[3] >> 6
+                track.audio_config = (object_type, rate_index, channels)
+                track.timescale = AAC_SAMPLE_RATES[rate_index]
+
+            track.samples.append([pts, 0, True, payload[pos + header_size:pos + frame_size]])
+            pts += AAC_FRAME_SAMPLES * TS_CLOCK / track.timescale
+            pos += frame_size
+
+        # 只有音频时按帧数输出fragment
+        if len(track.samples) >= AUDIO_FRAGMENT_FRAMES and not self._has_video():
+            output = self._fragment()
+
+        return output
+
+    def _has_video(self):
+        return STREAM_H264 in self._streams.values() or self.tracks["video"] in self.output
+
+    def _header(self):
+        """
+            首个fragment输出前写入 ftyp+moov，编码参数不全的track不写入
+        """
+        self.output = [track for track in self.tracks.values() if track.samples and track.ready]
+        if not self.output:
+            return b""
+
+        for index, track in enumerate(self.output):
+            track.track_id = index + 1
+
+        # 所有track从最早的sample开始计时
+        self.origin = min(track.samples[0][0] for track in self.output)
+
+        ftyp = box(b"ftyp", b"isom", struct.pack(">I", 0x200), b"isomiso6avc1mp41")
+        mvhd = full_box(b"mvhd", 0, 0, struct.pack(">IIII", 0, 0, 1000, 0), struct.pack(">IH", 0x00010000, 0x0100), bytes(10),
+                        struct.pack(">9I", 0x00010000, 0, 0, 0, 0x00010000, 0, 0, 0, 0x40000000), bytes(24),
+                        struct.pack(">I", len(self.output) + 1))
+        mvex = box(b"mvex", *[full_box(b"trex", 0, 0, struct.pack(">IIIII", track.track_id, 1, 0, 0, 0)) for track in self.output])
+
+        return ftyp + box(b"moov", mvhd, *[track.trak() for track in self.output], mvex)
+
+    def _fragment(self, until: int = None):
+        """
+            输出一个 moof+mdat
+
+            Args:
+                until (int, optional): 只输出dts小于该值的sample，最后一个视频sample的时长按该值计算. Defaults to None.
+        """
+        header = b""
+        if self.origin is None:
+            header = self._header()
+            if not self.output:
+                return b""
+
+        trafs = []
+        for track in self.output:
+            if until is None:
+                samples, track.samples = track.samples, []
+            else:
+                count = 0
+                while count < len(track.samples) and track.samples[count][0] < until:
+                    count += 1
+                samples, track.samples = track.samples[:count], track.samples[count:]
+
+            if samples:
+                trafs.append((track, samples, self._durations(track, samples, until)))
+
+        # 未写入moov的track（编码参数不全）丢弃
+        for track in self.tracks.values():
+            if track not in self.output:
+                track.samples = []
+
+        if not trafs:
+            return header
+
+        self.sequence += 1
+
+        def moof(data_offset: int):
+            boxes = []
+            offset = data_offset
+            for track, samples, durations in trafs:
+                video = track.kind == "video"
+                flags = 0x000001 | 0x000100 | 0x000200 | 0x000400 | (0x000800 if video else 0)
+                entries = b"".join(
+                    struct.pack(">IIIi", duration, len(data), SYNC_SAMPLE_FLAGS if key else NON_SYNC_SAMPLE_FLAGS, track.convert(offset_cts))
+                    if video else struct.pack(">III", duration, len(data), SYNC_SAMPLE_FLAGS)
+                    for (_, offset_cts, key, data), duration in zip(samples, durations)
+                )
+                decode_time = max(track.convert(samples[0][0] - self.origin), 0)
+
+                boxes.append(box(
+                    b"traf",
+                    full_box(b"tfhd", 0, 0x020000, struct.pack(">I", track.track_id)),
+                    full_box(b"tfdt", 1, 0, struct.pack(">Q", decode_time)),
+                    full_box(b"trun", 1, flags, struct.pack(">Ii", len(samples), offset), entries),
+                ))
+                offset += sum(len(sample[3]) for sample in samples)
+
+            return box(b"moof", full_box(b"mfhd", 0, 0, struct.pack(">I", self.sequence)), *boxes)
+
+        # data_offset相对moof开头，moof大小与data_offset的值无关
+        moof_size = len(moof(0))
+        mdat = box(b"mdat", *[sample[3] for _, samples, _ in trafs for sample in samples])
+
+        return header + moof(moof_size + 8) + mdat
+
+    @staticmethod
+    def _durations(track: Track, samples: List[list], until: int = None):
+        """
+            每个sample的时长（track的时间单位），视频按相邻dts计算
+        """
+        if track.kind == "audio":
+            return [AAC_FRAME_SAMPLES] * len(samples)
+
+        durations = []
+        for index, sample in enumerate(samples):
+            if index + 1 < len(samples):
+                following = samples[index + 1][0]
+            elif until is not None:
+                following = until
+            else:
+                following = None
+
+            duration = track.convert(following - sample[0]) if following is not None else track.duration
+            if duration > 0:
+                track.duration = duration
+            durations.append(max(duration, 0) or track.duration)
+
+        return durations
@@ -0,0 +1,143 @@
+import time
+import random
+import asyncio
+from typing import Any, Awaitable, Callable, Optional
+
+from metrics import metrics
+
+
+# 错误分类
+TIMEOUT = "timeout"    # 超时、连接断开等网络错误
+EXPIRED = "expired"    # 401/403，下载地址签名过期，需要重新获取地址
+SERVER = "server"      # 429/5xx，服务器繁忙
+FATAL = "fatal"        # 其他错误，重试无意义
+
+
+class RetryBudgetExceeded(Exception):
+    """
+        重试次数超出限制
+    """
+
+
+class RetryPolicy(object):
+
+    def __init__(self, max_retries: int = 5, budget: int = 100, refill: float = 0.5, base_delay: float = 1.0, max_delay: float = 60.0):
+        """
+            带抖动的指数退避重试策略，多个下载共用一个实例时共享全局重试次数
+
+            全局重试次数按令牌桶恢复：短时间内大量失败（如断网）时很快用完并放弃，
+            长时间的批量下载中零星的失败不会累计耗尽
+
+            Args:
+                max_retries (int): 单个区间/分片连续失败的最大重试次数
+                budget (int): 所有下载共享的重试次数上限（令牌桶容量）
+                refill (float): 每秒恢复的重试次数
+                base_delay (float): 首次重试的等待时间（秒）
+                max_delay (float): 最长等待时间（秒）
+        """
+        self.max_retries = max_retries
+        self.capacity = budget
+        self.budget = float(budget)
+        self.refill = refill
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._updated = time.monotonic()
+
+    @staticmethod
+    def classify(e: Exception):
+        # 只在出错时用到，不在模块导入时加载httpx
+        import httpx
+
+        if isinstance(e, httpx.HTTPStatusError):
+            code = e.response.status_code
+            if code in (401, 403):
+                return EXPIRED
+            if code == 429 or code >= 500:
+                return SERVER
+            return FATAL
+
+        if isinstance(e, (httpx.TransportError, asyncio.TimeoutError, ConnectionError)):
+            return TIMEOUT
+
+        return FATAL
+
+    def consume(self, attempt: int):
+        """
+            消耗一次重试机会
+
+            Args:
+                attempt (int): 当前连续失败次数（从1开始）
+
+            Raises:
+                RetryBudgetExceeded: 超出单次或全局重试次数
+        """
+        if attempt > self.max_retries:
+            raise RetryBudgetExceeded(f"连续失败{attempt}次，放弃重试")
+
+        now = time.monotonic()
+        self.budget = min(self.capacity, self.budget + (now - self._updated) * self.refill)
+        self._updated = now
+
+        if self.budget < 1:
+            raise RetryBudgetExceeded("短时间内重试次数过多，放弃重试")
+
+        self.budget -= 1
+
+    async def call(self, action: Callable[[], Awaitable[Any]], *, video: str, label: Any,
+                   refresh: Optional[Callable[[], Awaitable[Any]]] = None, progress: Optional[Callable[[], Any]] = None,
+                   on_retry: Optional[Callable[[str], None]] = None):
+        """
+            执行 action，失败时按错误类型重试：过期时调用 refresh 后立即重试，其他可重试的错误退避后重试
+
+            Args:
+                action (Callable): 每次重试重新调用
+                video (str): 记录重试事件的视频名
+                label (Any): 日志中的位置，如区间序号、分片序号
+                refresh (Callable, optional): 地址过期(401/403)时调用，为空时过期直接失败. Defaults to None.
+                progress (Callable, optional): 返回当前进度，有进展时重新计算连续失败次数. Defaults to None.
+                on_retry (Callable, optional): 每次重试前以日志内容调用，用于统计和输出. Defaults to None.
+
+            Raises:
+                RetryBudgetExceeded: 超出单次或全局重试次数
+                Exception: 不可重试的错误
+
+            Returns:
+                action 的返回值
+        """
+        attempt = 0
+        last = progress() if progress else None
+
+        while True:
+            try:
+                return await action()
+            except Exception as e:
+                kind = self.classify(e)
+                if kind == FATAL or (kind == EXPIRED and refresh is None):
+                    raise
+
+                if progress:
+                    current = progress()
+                    attempt = attempt + 1 if current == last else 1
+                    last = current
+                else:
+                    attempt += 1
+                self.consume(attempt)
+
+                metrics.emit("retry", video=video, kind=kind, attempt=attempt, error=repr(e))
+                if on_retry:
+                    on_retry("{}:下载出错({}),第{}次重试\n报错信息:{}".format(label, kind, attempt, e))
+
+                if kind == EXPIRED:
+                    await refresh()
+                else:
+                    await self.wait(attempt, kind)
+
+    async def wait(self, attempt: int, kind: str):
+        """
+            等待 base_delay * 2^(attempt-1)，取其一半加随机抖动，服务器繁忙时加倍
+        """
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        if kind == SERVER:
+            delay = min(self.max_delay, delay * 2)
+
+        await asyncio.sleep(delay / 2 + random.uniform(0, delay / 2))
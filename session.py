@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import json
+import time
+import asyncio
+import threading
+import weakref
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from login import Login, LoginExpired
+
+if TYPE_CHECKING:
+    import httpx
+
+
+# 距离过期不足该时间（秒）时提前刷新
+REFRESH_MARGIN = 300
+# 刷新后过期时间仍在提前量之内时（服务器签发的有效期较短），该时间（秒）内不再刷新
+REFRESH_COOLDOWN = 600
+# token pattern 中表示过期时间的字段
+EXPIRE_FIELDS = ("exp", "expire", "expires", "expire_time")
+
+
+class Session(object):
+
+    def __init__(self, cookies_path: Path = Path('Cache/cookies.json'), margin: int = REFRESH_MARGIN, cooldown: int = REFRESH_COOLDOWN):
+        """
+            内存中的登录状态，所有视频共用
+
+            cookies与token pattern只从磁盘读取一次，编码后的token按 (cid, term_id) 缓存
+            登录状态快过期时用保存的浏览器配置无窗口刷新（Login.login(headless=True)），批量下载不需要人工扫码
+
+            Args:
+                cookies_path (Path): Login保存的cookies
+                margin (int): 距离过期不足该时间（秒）时刷新
+                cooldown (int): 刷新后仍快过期时，间隔该时间（秒）才再次刷新
+        """
+        self.cookies_path = cookies_path
+        self.margin = margin
+        self.cooldown = cooldown
+
+        self._raw_cookies: Optional[List[dict]] = None
+        self._fields: Optional[dict] = None
+        self._tokens: Dict[Tuple[int, int], str] = {}
+
+        # 每次刷新加一，client中的cookies版本落后时更新
+        self.version = 0
+        self._applied = weakref.WeakKeyDictionary()
+
+        # 解析课程在线程池中进行，刷新加线程锁；无窗口刷新失败后不再重试
+        self._lock = threading.Lock()
+        self.expired = False
+        self._next_refresh = 0.0
+
+    def _load_cookies(self):
+
+        if self._raw_cookies is None:
+            self._raw_cookies = json.loads(self.cookies_path.read_bytes()) if self.cookies_path.exists() else []
+        return self._raw_cookies
+
+    def _load(self):
+
+        self._load_cookies()
+        if self._fields is None:
+            self._fields = Login.load_token_fields()
+
+    @property
+    def cookies(self):
+        """
+            Returns:
+                dict: name => value，同 Login.load_cookie
+        """
+        return {cookie['name']: cookie['value'] for cookie in self._load_cookies()}
+
+    def token(self, cid: int, term_id: int):
+        """
+            编码后的token，同 Login.load_token
+        """
+        key = (cid, term_id)
+        if key not in self._tokens:
+            self._load()
+            self._tokens[key] = Login.encode_token(self._fields, cid, term_id)
+        return self._tokens[key]
+
+    def expires_at(self):
+        """
+            登录状态的过期时间戳
+
+            token pattern中有过期时间字段时以其为准，否则取token中用到的cookies（如skey）最早的过期时间
+
+            Returns:
+                float: 时间戳，无法判断时为None
+        """
+        self._load()
+
+        for name in EXPIRE_FIELDS:
+            value = str(self._fields.get(name, ""))
+            if value.isdigit():
+                value = int(value)
+                return value / 1000 if value > 1e12 else value
+
+        values = {str(value) for value in self._fields.values()}
+        expires = [
+            cookie['expires'] for cookie in self._raw_cookies
+            if cookie.get('expires', -1) > 0 and (cookie['name'] in self._fields or cookie['value'] in values)
+        ]
+        return min(expires) if expires else None
+
+    def is_expired(self):
+
+        expires = self.expires_at()
+        return expires is not None and expires - self.margin < time.time()
+
+    def needs_refresh(self):
+        """
+            快过期且可以刷新：无窗口刷新未失败过，且不在刷新后的冷却时间内
+        """
+        return not self.expired and time.time() >= self._next_refresh and self.is_expired()
+
+    def reload(self):
+        """
+            清空内存中的cookies与token，下次使用时重新读取
+        """
+        self._raw_cookies = None
+        self._fields = None
+        self._tokens = {}
+        self.version += 1
+
+    def refresh(self):
+        """
+            快过期时无窗口刷新cookies与token pattern，已被其他线程刷新时跳过
+
+            Returns:
+                bool: 是否刷新
+        """
+        with self._lock:
+            if not self.needs_refresh():
+                return False
+
+            print("登录状态即将过期，正在刷新cookies与token...")
+            try:
+                Login().login(headless=True)
+            except LoginExpired as e:
+                self.expired = True
+                print(e)
+                return False
+            except Exception as e:
+                self.expired = True
+                print(f"刷新登录状态失败 => {e}")
+                return False
+
+            self.reload()
+
+            # 新的过期时间仍在提前量之内时，避免每次解析地址都重新启动浏览器
+            if self.is_expired():
+                self._next_refresh = time.time() + self.cooldown
+                print(f"刷新后登录状态的有效期仍不足{self.margin}秒，{self.cooldown}秒内不再刷新")
+            return True
+
+    async def ensure(self, client: httpx.AsyncClient = None):
+        """
+            解析视频地址前调用：快过期时在线程中刷新，并把新的cookies更新到client
+
+            Args:
+                client (httpx.AsyncClient, optional): 共用的连接池client，见create_client. Defaults to None.
+        """
+        if self.needs_refresh():
+            await asyncio.to_thread(self.refresh)
+
+        if client is not None and self._applied.get(client, 0) != self.version:
+            client.cookies.update(self.cookies)
+            self._applied[client] = self.version
+
+
+session = Session()
@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import json
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List
+
+if TYPE_CHECKING:
+    from models import TaskInfoItem
+
+
+SNAPSHOT_PATH = Path('Cache/sync')
+
+
+class CourseSnapshot(object):
+
+    def __init__(self, cid: int, path: Path = SNAPSHOT_PATH):
+        """
+            课程上次同步时的快照，只记录已下载完成的task：taid => {resid_list, resid_ext, size}
+            与最新的basic_info对比，只下载新增或改变的task
+
+            Args:
+                cid (int): 课程cid
+                path (Path): 快照文件夹
+        """
+        self.cid = cid
+        self.file_path = path.joinpath(f"{cid}.json")
+        self.tasks: Dict[str, dict] = {}
+
+        if self.file_path.exists():
+            self.tasks = json.loads(self.file_path.read_text()).get("tasks", {})
+
+        self.added: List[TaskInfoItem] = []
+        self.changed: List[TaskInfoItem] = []
+        self.existing: List[TaskInfoItem] = []
+
+    @staticmethod
+    def _fingerprint(task: TaskInfoItem):
+        # 视频重新上传后resid_list与resid_ext随之改变
+        return {"resid_list": task.resid_list, "resid_ext": task.resid_ext}
+
+    def _record(self, task: TaskInfoItem, size: int = 0):
+        self.tasks[task.taid] = {**self._fingerprint(task), "name": task.name, "size": size}
+
+    def diff(self, tasks: List[TaskInfoItem]):
+        """
+            对比快照，返回需要下载的task，不修改本地文件
+
+            新增：快照中没有且本地不存在的task（本地已存在的记入self.existing）
+            改变：resid_list/resid_ext变化的task
+
+            Returns:
+                tasks:list[TaskInfoItem]
+        """
+        self.added, self.changed, self.existing = [], [], []
+
+        for task in tasks:
+            record = self.tasks.get(task.taid)
+
+            if record is None:
+                if task.download_path.exists():
+                    self.existing.append(task)
+                else:
+                    self.added.append(task)
+
+            elif {key: record.get(key) for key in ("resid_list", "resid_ext")} != self._fingerprint(task):
+                self.changed.append(task)
+
+        return self.added + self.changed
+
+    def prepare(self):
+        """
+            下载前执行：本地已存在的task直接记入快照，改变的task旧文件重命名为 *.old.ts（或 *.old.mp4）
+        """
+        for task in self.existing:
+            self._record(task, task.download_path.stat().st_size)
+
+        for task in self.changed:
+            if task.download_path.exists():
+                task.download_path.replace(task.download_path.with_suffix(".old" + task.download_path.suffix))
+
+        self.save()
+
+    def mark(self, task: TaskInfoItem, size: int):
+        """
+            task下载完成后记入快照
+
+            Args:
+                task (TaskInfoItem):
+                size (int): 视频文件大小（transcodeList totalSize）
+        """
+        self._record(task, size)
+        self.save()
+
+    def save(self):
+
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+
+        tmp_path = self.file_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({"cid": self.cid, "updated": time.time(), "tasks": self.tasks}, ensure_ascii=False, indent=4))
+        tmp_path.replace(self.file_path)
@@ -0,0 +1,133 @@
+import queue
+import asyncio
+import threading
+from pathlib import Path
+from typing import Callable, Optional
+
+
+# 队列中等待写入的数据上限（字节），超出时下载协程等待磁盘
+MAX_PENDING = 32 * 1024 * 1024
+
+
+class AsyncWriter(object):
+
+    def __init__(self, path: Path, max_pending: int = MAX_PENDING):
+        """
+            在独立的I/O线程中按偏移写入已存在的文件，事件循环只负责把数据放入队列
+
+            队列按提交顺序执行，submit的回调在之前提交的数据写入后才执行（如记录断点续传日志）
+            等待写入的数据超过 max_pending 时，wait() 阻塞到I/O线程写出一部分
+
+            Args:
+                path (Path): 写入的文件，需已存在
+                max_pending (int): 等待写入的数据上限（字节）
+        """
+        self.path = path
+        self.max_pending = max_pending
+        self.pending = 0
+        self.error: Optional[BaseException] = None
+
+        self._queue = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._space: Optional[asyncio.Event] = None
+
+    def _start(self):
+
+        if self._thread is None:
+            self._loop = asyncio.get_running_loop()
+            self._space = asyncio.Event()
+            self._thread = threading.Thread(target=self._run, name=f"writer-{self.path.name}", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+
+        with open(self.path.absolute(), 'rb+') as f:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+
+                offset, data, callback, done = item
+                try:
+                    # 出错后不再写入，等待事件循环处理
+                    if self.error is None:
+                        if data:
+                            f.seek(offset)
+                            f.write(data)
+                        if callback or done:
+                            f.flush()
+                        if callback:
+                            callback()
+                except BaseException as e:
+                    self.error = e
+                finally:
+                    if data:
+                        self._loop.call_soon_threadsafe(self._release, len(data))
+                    if done:
+                        self._loop.call_soon_threadsafe(done.set_result, None)
+
+    def _release(self, size: int):
+
+        self.pending -= size
+        if self.pending < self.max_pending:
+            self._space.set()
+
+    def _check(self):
+
+        if self.error is not None:
+            raise self.error
+
+    def write(self, offset: int, data: bytes):
+        """
+            提交写入，不等待
+        """
+        self._start()
+        self._check()
+
+        self.pending += len(data)
+        self._queue.put((offset, data, None, None))
+
+    def submit(self, callback: Callable[[], None]):
+        """
+            之前提交的数据写入后在I/O线程中执行callback
+        """
+        self._start()
+        self._queue.put((0, b"", callback, None))
+
+    async def wait(self):
+        """
+            等待写入的数据超过上限时等待，下载协程借此对磁盘速度做背压
+        """
+        self._check()
+
+        while self.pending >= self.max_pending:
+            self._space.clear()
+            await self._space.wait()
+            self._check()
+
+    async def drain(self):
+        """
+            等待已提交的写入和回调全部完成
+        """
+        if self._thread is None:
+            return
+
+        done = self._loop.create_future()
+        self._queue.put((0, b"", None, done))
+        await done
+        self._check()
+
+    async def close(self):
+        """
+            写完剩余数据后结束I/O线程
+        """
+        if self._thread is None:
+            return
+
+        try:
+            await self.drain()
+        finally:
+            self._queue.put(None)
+            await asyncio.to_thread(self._thread.join)
+            self._thread = None